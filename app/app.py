@@ -1,18 +1,30 @@
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
-from slack_sdk import WebClient
+from flask import Flask, render_template, request, jsonify, Response, g
+from slack_sdk.webhook import WebhookClient
 from slack_sdk.signature import SignatureVerifier
+from slack_sdk.errors import SlackApiError
+from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
 from slackeventsapi import SlackEventAdapter
-import schedule
 import time
 import threading
 import sqlite3
 import json # do i need to import?
 import os
 import re
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util import Retry
+import fnmatch
+from uptime_robot import get_status, get_monitor, get_monitors_page, get_account_monitors, iter_monitors, fresh_saved_monitor, friendly_statuses
+from status_cache import monitor_cache
+import db
+import outbox
+from jobs import command_jobs, home_jobs
+from scheduler import webhook_reconcile_interval
+from checks import client, save_status_changes, run_schedule, slack_bot_token, slack_api_url
+import home
+import metrics
+import webhooks
+import history
+import migrations
+import profiling
 
 
 
@@ -23,24 +35,13 @@ app = Flask(__name__)
 port = os.getenv("PORT", 5000)
 debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
 
-
-db_path = os.getenv("DB_PATH")
-
-uptime_api_url = os.getenv("UPTIME_API_URL", "https://api.uptimerobot.com/v2/getMonitors")
-
-slack_bot_token = os.getenv("SLACK_BOT_TOKEN")
 slack_signing_secret = os.getenv("SLACK_SIGNING_SECRET")
 
-# Check if required environment variables are set
-if not slack_bot_token:
-    raise ValueError("SLACK_BOT_TOKEN environment variable is not set.")
+# Check if required environment variables are set (checks.py checks the Slack token and DB path)
 if not slack_signing_secret:
     raise ValueError("SLACK_SIGNING_SECRET environment variable is not set.")
 
-if not db_path:
-    raise ValueError("DB_PATH environment variable is not set.")
-
-client = WebClient(token=slack_bot_token)
+migrations.migrate()
 verifier = SignatureVerifier(slack_signing_secret)
 slack_event_adapter = SlackEventAdapter(
     slack_signing_secret, "/slack/events", app
@@ -52,114 +53,137 @@ def index():
     return render_template("index.html")
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.content_type)
+
+
+# Profile requests when it's been asked for (see profiling.py)
+@app.before_request
+def start_request_profile():
+    g.profile = profiling.start("request", request.path)
+
+
+@app.teardown_request
+def finish_request_profile(exception):
+    profiling.finish(g.pop("profile", None))
+
+
+# Profile the next check cycles and/or requests of every process. Needs PROFILE_TOKEN to be set and sent
+# as "Authorization: Bearer <token>".
+@app.route("/admin/profile", methods=["POST"])
+def admin_profile():
+    if not profiling.profile_token:
+        return "Not found", 404
+    if not profiling.authorized(request.headers.get("Authorization")):
+        return "Forbidden", 403
+
+    # Only the kinds that were asked for are changed
+    cycles = request.values.get("cycles")
+    requests = request.values.get("requests")
+    if cycles is None and requests is None:
+        return jsonify({"error": "Give cycles and/or requests to profile."}), 400
+    try:
+        cycles = None if cycles is None else max(0, min(int(cycles), 100))
+        requests = None if requests is None else max(0, min(int(requests), 1000))
+    except ValueError:
+        return jsonify({"error": "cycles and requests must be numbers."}), 400
+
+    try:
+        profiling.arm(cycles, requests)
+    except sqlite3.Error as e:
+        if debug_mode:
+            print(f"Error saving the profiling request: {e}")
+        return jsonify({"error": "Error saving the profiling request."}), 500
+    return jsonify({"cycles": cycles, "requests": requests, "profile_dir": os.path.abspath(profiling.profile_dir)})
+
+
+# UptimeRobot webhook alert contact for accounts in push mode.
+# /enable-webhook gives the user the URL and the JSON POST value to use, which carries the account id and
+# secret. Only the JSON body is read, a secret in the query string would be written to the access log.
+@app.route("/uptimerobot/webhook", methods=["POST"])
+def uptimerobot_webhook():
+    if "secret" in request.args:
+        return "Send the secret in the JSON body, not the URL. Run /enable-webhook again to get the new setup.", 400
+    values = request.get_json(silent=True)
+    if not isinstance(values, dict):
+        return "Send the alert as a JSON object.", 400
+
+    try:
+        api_key = webhooks.authenticate(values.get("account"), values.get("secret"))
+    except sqlite3.Error as e:
+        if debug_mode:
+            print(f"Error checking the webhook account: {e}")
+        return "Error checking the webhook account.", 500
+    if not api_key:
+        return "Invalid account or secret.", 403
+
+    try:
+        alert_type = int(values.get("alertType"))
+    except (TypeError, ValueError):
+        return "Missing or invalid alertType.", 400
+    status = webhooks.alert_statuses.get(alert_type)
+    if status is None:
+        return "", 200  # Not an up/down alert (eg. SSL expiry), nothing to do
+
+    # Match sites the same way the scheduled check does: on the monitor id if the site has one stored,
+    # otherwise on the friendly name or the url's host
+    monitor_id = str(values.get("monitorID") or "")
+    monitor_id = int(monitor_id) if monitor_id.isdigit() else None
+    host = re.sub(r"^https?://", "", str(values.get("monitorURL") or "")).split("/")[0]
+    websites = {str(values.get("monitorFriendlyName") or ""), host} - {""}
+    if not websites and monitor_id is None:
+        return "Missing monitorID, monitorFriendlyName or monitorURL.", 400
+    placeholders = ", ".join("?" for _ in websites)
+    try:
+        sites = db.fetch_all(
+            f"SELECT user_id, channel_id, website, last_status FROM monitor_sites WHERE api_key = ? AND (monitor_id = ? OR (monitor_id IS NULL AND website IN ({placeholders})))",
+            [api_key, monitor_id, *websites]
+        )
+    except sqlite3.Error as e:
+        if debug_mode:
+            print(f"Error fetching sites from the database: {e}")
+        return "Error fetching sites from the database.", 500
+
+    changes = []
+    for user_id, channel_id, website, last_status in sites:
+        monitor_cache.invalidate((api_key, website))
+        if str(last_status) != str(status):
+            changes.append((status, user_id, channel_id, website, last_status))
+
+    changes = save_status_changes(changes)
+    if isinstance(changes, str):
+        return changes, 500
+    if debug_mode:
+        print(f"Webhook alert {alert_type} for monitor {monitor_id} ({', '.join(websites)}): {len(sites)} sites, {len(changes)} changed.")
+    return "", 200
+
+
+# Slack notification queue depth and delivery latency
+@app.route("/outbox/stats")
+def outbox_stats():
+    try:
+        return jsonify(outbox.stats())
+    except sqlite3.Error as e:
+        if debug_mode:
+            print(f"Error reading the Slack outbox: {e}")
+        return jsonify({"error": "Error reading the Slack outbox."}), 500
+
+
 # App home page
 @slack_event_adapter.on("app_home_opened")
 def handle_app_home_opened(event_data):
     user_id = event_data["event"]["user"]
     
-    # Fetch the user's websites from the database
+    # Only publish when the view has changed. If the event has no view the user has never been sent
+    # one (or Slack lost it) so always publish then.
+    force = "view" not in event_data["event"]
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT user_id, channel_id, website, last_status FROM monitor_sites WHERE user_id = ?", (user_id,))
-        rows = cursor.fetchall()
-        conn.close()
+        home.publish_home(client, user_id, force=force)
     except sqlite3.Error as e:
         if debug_mode:
             print(f"Error fetching sites from the database: {e}")
         return jsonify({"error": "Error fetching sites from the database."}), 500
-    site_blocks = []
-
-    # Append real sites
-    if rows:
-        site_blocks = [
-            {
-                "type": "section",
-                "text": {
-                    "type": "plain_text",
-                    "emoji": True,
-                    "text": "Here are your sites that are currently being monitored:"
-                }
-            },
-            {"type": "divider"}
-        ]
-        for row in rows:
-            user_id, channel_id, website, last_status = row
-            try:
-                last_status = int(last_status)
-            except (ValueError, TypeError):
-                last_status = 10
-            friendly_status = {
-                0: "Paused",
-                1: "Not checked yet",
-                2: ":uptimerobot-up: Up",
-                8: "Seems down",
-                9: ":uptimerobot-down: Down",
-            }.get(last_status, "Unknown")
-            site_blocks.append({
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"""
-                        *<https://{website}|{website}>*\n
-• Status: *{friendly_status}* (Code: {last_status})
-• Notification Channel: <#{channel_id}>"""
-                },
-                "accessory": {
-                    "type": "button",
-                    "style": "danger",
-                    "text": {
-                        "type": "plain_text",
-                        "emoji": True,
-                        "text": "Remove"
-                    },
-                    "value": f"remove|{website}|{channel_id}"
-                }
-            })
-            site_blocks.append({"type": "divider"})
-
-        # Add help section
-        site_blocks.extend([
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": "You can add or remove a monitor using the following commands:"
-                }
-            },
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": "`/monitor-site [url] | [api key]`  Add a new site\n `/remove-monitor-site [url] | [api key]`  Remove a site"
-                }
-            }
-        ])
-    else:
-        site_blocks.append({
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": "No monitors were found for your current user."
-            }
-        })
-        site_blocks.append({"type": "divider"})
-        site_blocks.append({
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": "You can add a monitor using the `/monitor-site [url] | [api key]` command."
-            }
-        })
-
-
-    client.views_publish(
-        user_id=user_id,
-        view={
-            "type": "home",
-            "blocks": site_blocks
-        }
-    )
 
 
 # Remove button
@@ -184,11 +208,7 @@ def slack_interactions():
             user_id = payload["user"]["id"]
 
             try:
-                db = sqlite3.connect(db_path)
-                cursor = db.cursor()
-                cursor.execute("DELETE FROM monitor_sites WHERE user_id=? AND channel_id=? AND website=?", (user_id, channel_id, website))
-                db.commit()
-                db.close()
+                db.execute("DELETE FROM monitor_sites WHERE user_id=? AND channel_id=? AND website=?", (user_id, channel_id, website))
             except sqlite3.Error as e:
                 if debug_mode:
                     print(f"Error removing site from the database: {e}")
@@ -209,11 +229,32 @@ def slack_interactions():
                     )
                 return "Error removing site from the database.", 500
 
+            home_jobs.submit(home.republish_homes, [user_id], client)
+
 
     return "", 200
 
 
 
+# /check-sites-in-db posts its results in messages of this many sites
+check_results_per_message = 20
+check_results_flush_seconds = 3
+# Client for posting /check-sites-in-db results, which waits out Slack's Retry-After when it's rate limited.
+# The shared client doesn't, the outbox handles rate limits itself without holding up its thread.
+results_client = metrics.InstrumentedWebClient(
+    token=slack_bot_token,
+    base_url=slack_api_url,
+    retry_handlers=[RateLimitErrorRetryHandler(max_retry_count=2)]
+)
+# Windows reported by /site-history
+site_history_windows = (("24 hours", 86400), ("7 days", 7 * 86400), ("30 days", 30 * 86400), ("365 days", 365 * 86400))
+
+
+# Commands that have to wait on UptimeRobot. Slack wants an answer within 3 seconds, so these are
+# acknowledged straight away and run as background jobs that send their result to the command's response_url.
+deferred_commands = ("/site-status", "/monitor-site", "/monitor-all-sites", "/check-sites-in-db", "/enable-webhook", "/disable-webhook")
+
+
 @app.route("/slack/command", methods=["POST"])
 def slack_command():
     command_text = request.form.get("text")
@@ -221,145 +262,59 @@ def slack_command():
     user_id = request.form.get("user_id")
     user_name = request.form.get("user_name")
     command = request.form.get("command")
+    response_url = request.form.get("response_url")
     if debug_mode:
         print(request.form)
 
-    # Check site status
-    if command == "/site-status":
-        if not command_text:
-            response = "Please provide a website and api key. Usage: `/site-status subdomain.example.com | <your api key here>`"
-            client.chat_postEphemeral(
-                channel=channel_id,
-                user=user_id,
-                text=response,
-                unfurl_links=False,
-                unfurl_media=False
-            )
-            return "", 200
-
-        response = site_status(command_text)
-        if not response:
-            response = "Unknown error."
-        
+    if command in ("/site-status", "/monitor-site") and not command_text:
+        response = f"Please provide a website and api key. Usage: `{command} subdomain.example.com | <your api key here>`"
         client.chat_postEphemeral(
             channel=channel_id,
             user=user_id,
             text=response,
-                unfurl_links=False,
-                unfurl_media=False
+            unfurl_links=False,
+            unfurl_media=False
         )
         return "", 200
 
-    # Add a site to monitoring db
-    elif command == "/monitor-site":
-        if not command_text:
-            response = "Please provide a website and api key. Usage: `/monitor-site subdomain.example.com | <your api key here>`"
-            client.chat_postEphemeral(
-                channel=channel_id,
-                user=user_id,
-                text=response,
-                unfurl_links=False,
-                unfurl_media=False
-            )
-            return "", 200
+    if command in ("/monitor-all-sites", "/enable-webhook", "/disable-webhook") and not (command_text or "").strip():
+        response = f"Please provide an api key. Usage: `{command} <your api key here>`"
+        if command == "/monitor-all-sites":
+            response += f" or `{command} <your api key here> | *.example.com`"
+        client.chat_postEphemeral(
+            channel=channel_id,
+            user=user_id,
+            text=response,
+            unfurl_links=False,
+            unfurl_media=False
+        )
+        return "", 200
 
-        result = monitor_site(command_text, user_id, channel_id)
-        if isinstance(result, tuple) and len(result) == 2 and result[1] == "error":
-            response = result[0]
-            error = True
-            if debug_mode:
-                print(result)
-        else:
-            if result:
-                response = result
-                error = False
-            else:
-                response = "Unknown error."
-                error = True
-
-        if error:
-            client.chat_postEphemeral(
-                channel=channel_id,
-                user=user_id,
-                text=response,
-                unfurl_links=False,
-                unfurl_media=False
-            )
-        else:
-            client.chat_postMessage(
-                channel=channel_id,
-                text=response,
-                unfurl_links=False,
-                unfurl_media=False
-            )
+    if command in deferred_commands:
+        if not command_jobs.submit(run_command, command, command_text, user_id, channel_id, response_url):
+            return jsonify({
+                "response_type": "ephemeral",
+                "text": "The bot is busy right now. Please try again in a minute."
+            }), 200
+        return jsonify({
+            "response_type": "ephemeral",
+            "text": "Working on it..."
+        }), 200
+
+    # Uptime report from the status history
+    elif command == "/site-history":
+        result = site_history(command_text)
+        response, error = unpack_result(result)
+        respond(None, channel_id, user_id, response, True)
         return "", 200
 
     # Remove a site from monitoring db
     elif command == "/remove-monitor-site":
         result = remove_monitor_site(command_text, channel_id, user_id)
-        if isinstance(result, tuple) and len(result) == 2 and result[1] == "error":
-            response = result[0]
-            error = True
-            if debug_mode:
-                print(result)
-        else:
-            if result:
-                response = result
-                error = False
-            else:
-                response = "Unknown error."
-                error = True
-
-        if error:
-            client.chat_postEphemeral(
-                channel=channel_id,
-                user=user_id,
-                text=response,
-                unfurl_links=False,
-                unfurl_media=False
-            )
-        else:
-            client.chat_postMessage(
-                channel=channel_id,
-                text=response,
-                unfurl_links=False,
-                unfurl_media=False
-            )
+        response, error = unpack_result(result)
+        respond(None, channel_id, user_id, response, error)
         return "", 200
 
-    elif command == "/check-sites-in-db":
-        result = check_sites_in_db()
-        if isinstance(result, tuple) and len(result) == 2 and result[1] == "error":
-            response = result[0]
-            error = True
-            if debug_mode:
-                print(result)
-        else:
-            if result:
-                response = result
-                error = False
-            else:
-                response = "Unknown error."
-                error = True
-        if error:
-            client.chat_postEphemeral(
-                channel=channel_id,
-                user=user_id,
-                text=response,
-                unfurl_links=False,
-                unfurl_media=False
-            )
-        else:
-            client.chat_postMessage(
-                channel=channel_id,
-                text=response,
-                unfurl_links=False,
-                unfurl_media=False
-            )
-        return "", 200
-
-
-    
     else:
         response = "Unknown command. How tf did you get here?"
         client.chat_postEphemeral(
@@ -368,12 +323,82 @@ def slack_command():
             text=response
         )
         return "", 200
-    
 
 
+# Run one of the deferred commands in the background and send the result back to Slack
+def run_command(command, command_text, user_id, channel_id, response_url):
+    # Check site status
+    if command == "/site-status":
+        response = site_status(command_text)
+        if not response:
+            response = "Unknown error."
+        respond(response_url, channel_id, user_id, response, True)
+
+    # Add a site to monitoring db
+    elif command == "/monitor-site":
+        result = monitor_site(command_text, user_id, channel_id)
+        response, error = unpack_result(result)
+        respond(response_url, channel_id, user_id, response, error)
+
+    # Add every monitor on an account
+    elif command == "/monitor-all-sites":
+        result = monitor_all_sites(command_text, user_id, channel_id)
+        response, error = unpack_result(result)
+        respond(response_url, channel_id, user_id, response, error)
 
+    elif command == "/check-sites-in-db":
+        result = check_sites_in_db(command_text, channel_id)
+        response, error = unpack_result(result)
+        respond(response_url, channel_id, user_id, response, error)
 
+    # Switch an account between push (webhook) and polling. The reply has the webhook secret in it, so
+    # it's only shown to the user who ran the command.
+    elif command == "/enable-webhook":
+        response, error = unpack_result(enable_webhook(command_text))
+        respond(response_url, channel_id, user_id, response, True)
 
+    elif command == "/disable-webhook":
+        response, error = unpack_result(disable_webhook(command_text))
+        respond(response_url, channel_id, user_id, response, True)
+
+
+# Command handlers return either a message or a (message, "error") tuple
+def unpack_result(result):
+    if isinstance(result, tuple) and len(result) == 2 and result[1] == "error":
+        if debug_mode:
+            print(result)
+        return result[0], True
+    if result:
+        return result, False
+    return "Unknown error.", True
+
+
+# Errors (and /site-status results) are only shown to the user who ran the command, everything else
+# is posted to the channel. Uses the command's response_url when there is one.
+def respond(response_url, channel_id, user_id, response, ephemeral):
+    if response_url:
+        with profiling.phase("slack"):
+            WebhookClient(response_url).send(
+                text=response,
+                response_type="ephemeral" if ephemeral else "in_channel",
+                unfurl_links=False,
+                unfurl_media=False
+            )
+    elif ephemeral:
+        client.chat_postEphemeral(
+            channel=channel_id,
+            user=user_id,
+            text=response,
+            unfurl_links=False,
+            unfurl_media=False
+        )
+    else:
+        client.chat_postMessage(
+            channel=channel_id,
+            text=response,
+            unfurl_links=False,
+            unfurl_media=False
+        )
 
 
 def split_text_on_pipe(input):
@@ -393,108 +418,6 @@ def split_text_on_pipe(input):
 
 
 
-# Get the status of a website using UptimeRobot API
-def get_status(website, uptime_api_key, mode="response"):
-    built_url = f"https://{uptime_api_url}?api_key={uptime_api_key}&monitors={website}"
-    if debug_mode:
-        print(built_url)
-    
-    session = requests.Session()
-    retries = Retry(
-        total=3,                 # Total number of retries
-        backoff_factor=1,        # Wait 1s, 2s, 4s between retries
-        status_forcelist=[500, 502, 503, 504],  # Retry on these HTTP status codes
-        allowed_methods=["POST"]  # Retry only POST requests
-    )
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-
-    try:
-        response = session.post(built_url)
-        data = response.json()
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching status: {e}"
-    except ValueError as e:
-        return f"Error parsing JSON response: {e}"
-    except json.JSONDecodeError as e:
-        return f"Error decoding JSON response: {e}"
-    except requests.exceptions.Timeout as e:
-        return f"Request timed out: {e}"
-    except requests.exceptions.TooManyRedirects as e:
-        return f"Too many redirects: {e}"
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching status: {e}"
-    except requests.exceptions.HTTPError as e:
-        return f"HTTP error occurred: {e}"
-    except requests.exceptions.ConnectionError as e:
-        return f"Connection error occurred: {e}"
-    except Exception as e:
-        return f"An unexpected error occurred: {e}"
-
-    """
-    try:
-        response = requests.post(built_url)
-        data = response.json()
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching status: {e}"
-    """
-
-    if data.get("stat") != "ok":
-        return "Error fetching status: Invalid response from UptimeRobot API."
-    if not data.get("monitors"):
-        return "No monitors found for the provided website."
-    if len(data["monitors"]) < 1:
-        return "No monitors found for the provided website."
-
-    if len(data["monitors"]) == 1:
-        monitor = data["monitors"][0]
-        friendly_name = monitor["friendly_name"]
-        url = monitor["url"]
-        status = monitor["status"]
-        friendly_status = {
-            0: "Paused",
-            1: "Not checked yet",
-            2: "Up",
-            8: "Seems down",
-            9: "Down",
-        }.get(status, "Unknown")
-
-        if mode == "response":
-            response = f"Website: {friendly_name}\nStatus: {friendly_status} (Status code: {status})\nURL: {url}"
-            return response
-        elif mode == "plain":
-            return status
-        else:
-            return "Invalid mode specified. Use 'response' or 'plain'."
-    else:
-        monitors = data["monitors"]
-        for monitor in monitors:
-            if monitor["friendly_name"] == website:
-                friendly_name = monitor["friendly_name"]
-                url = monitor["url"]
-                status = monitor["status"]
-                friendly_status = {
-                    0: "Paused",
-                    1: "Not checked yet",
-                    2: "Up",
-                    8: "Seems down",
-                    9: "Down",
-                }.get(status, "Unknown")
-
-                if mode == "response":
-                    response = f"Website: {friendly_name}\nStatus: {friendly_status} (Status code: {status})\nURL: {url}"
-                    return response
-                elif mode == "plain":
-                    return status
-                else:
-                    return "Invalid mode specified. Use 'response' or 'plain'."
-
-        return "No monitors found for the provided website."
-
-
-
-
 # --------------------------------------------------Command handlers-------------------------------------------------
 
 # Check the status of a site. This is mainly for testing
@@ -533,37 +456,85 @@ def monitor_site(command_text, user_id, channel_id):
         response = "Please provide a valid website without the scheme (the http/https part) or path.\nExample website: `subdomain.example.com`"
         return response, "error"
     else:
-        # Check that the info is valid
+        # Check that the info is valid, and keep the monitor's id so it can be polled by id
         statuses = [0, 1, 2, 8, 9]
-        status = get_status(website, uptime_api_key, mode="plain")
-        if not get_status(website, uptime_api_key, mode="plain") in statuses:
+        monitor = get_monitor(website, uptime_api_key)
+        status = monitor.get("status") if isinstance(monitor, dict) else None
+        if not status in statuses:
             response = "There was an error when verifying your site. Please check that the website is valid and that the API key is correct."
             return response, "error"
 
-        # Add the site to the db
+        # Add the site to the db, unless it's already being monitored in this channel
         try:
-            db = sqlite3.connect(db_path)
-            cursor = db.cursor()
-
-            # Check if the site already exists in the database
-            cursor.execute("SELECT * FROM monitor_sites WHERE user_id=? AND channel_id=? AND website=?", (user_id, channel_id, website))
-            existing_site = cursor.fetchone()
-            if existing_site:
-                response = f"Hey <@{user_id}>! Your site ({website}) is already being monitored in this channel. Nothing has been changed."
-                return response, "error"
-
-            cursor.execute("INSERT INTO monitor_sites (user_id, channel_id, website, api_key, last_status) VALUES (?, ?, ?, ?, ?)", (user_id, channel_id, website, uptime_api_key, status))
-            db.commit()
-            db.close()
+            added = db.execute(
+                "INSERT INTO monitor_sites (user_id, channel_id, website, api_key, last_status, monitor_id) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, channel_id, website) DO NOTHING",
+                (user_id, channel_id, website, uptime_api_key, status, monitor.get("id"))
+            )
         except sqlite3.Error as e:
             response = f"Error adding site to the database: {e}"
             return response, "error"
+        if not added:
+            response = f"Hey <@{user_id}>! Your site ({website}) is already being monitored in this channel. Nothing has been changed."
+            return response, "error"
         
         response = f"Hey <@{user_id}>! Your site ({website}) has been successfully added to the db of sites to monitor. Notifications will be posted in the current channel, <#{channel_id}>."
 
         return response
 
 
+# Add every monitor on an UptimeRobot account (optionally only the ones whose website matches a pattern
+# like *.example.com) in one go. The account is paged through once and all of the sites are inserted in
+# one transaction, with their monitor ids so they're polled by id straight away.
+def monitor_all_sites(command_text, user_id, channel_id):
+    if "|" in command_text:
+        try:
+            uptime_api_key, pattern = split_text_on_pipe(command_text)
+        except ValueError:
+            return "Improperly formatted command. Example: `/monitor-all-sites <your api key here> | *.example.com`", "error"
+    else:
+        uptime_api_key, pattern = command_text.strip(), ""
+
+    monitors = get_account_monitors(uptime_api_key)
+    if isinstance(monitors, str):
+        if debug_mode:
+            print(monitors)
+        return "There was an error when fetching the monitors on your account. Please check that the API key is correct.", "error"
+
+    rows = {}
+    skipped = 0
+    for monitor in monitors:
+        # Sites are stored without the scheme, same as /monitor-site. Monitors that aren't for a website
+        # (eg. a ping monitor on an IP address) are skipped.
+        host = re.sub(r"^https?://", "", monitor.get("url") or "").split("/")[0].split(":")[0]
+        website = host if re.match(r"^[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", host) else None
+        if not website:
+            skipped += 1
+            continue
+        if pattern and not fnmatch.fnmatch(website.lower(), pattern.lower()):
+            continue
+        # Several monitors can watch the same website (eg. keyword monitors on different pages), keep the first
+        rows.setdefault(website, (user_id, channel_id, website, uptime_api_key, monitor.get("status"), monitor.get("id")))
+
+    if not rows:
+        return f"No monitors on this account matched `{pattern}`." if pattern else "No website monitors found on this account.", "error"
+
+    try:
+        with db.transaction() as conn:
+            added = conn.executemany(
+                "INSERT INTO monitor_sites (user_id, channel_id, website, api_key, last_status, monitor_id) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, channel_id, website) DO NOTHING",
+                list(rows.values())
+            ).rowcount
+    except sqlite3.Error as e:
+        return f"Error adding sites to the database: {e}", "error"
+
+    response = f"Hey <@{user_id}>! {added} sites from your UptimeRobot account have been added to the db of sites to monitor. Notifications will be posted in the current channel, <#{channel_id}>."
+    if len(rows) - added:
+        response += f"\n{len(rows) - added} were already being monitored in this channel."
+    if skipped:
+        response += f"\n{skipped} monitors were skipped because they aren't for a website."
+    return response
+
+
 # Remove a site from the list of sites to monitor
 def remove_monitor_site(command_text, channel_id, user_id):
     if not command_text:
@@ -582,11 +553,7 @@ def remove_monitor_site(command_text, channel_id, user_id):
     else:
         # Remove the site from the db
         try:
-            db = sqlite3.connect(db_path)
-            cursor = db.cursor()
-            cursor.execute("DELETE FROM monitor_sites WHERE user_id=? AND channel_id=? AND website=?", (user_id, channel_id, website))
-            db.commit()
-            db.close()
+            db.execute("DELETE FROM monitor_sites WHERE user_id=? AND channel_id=? AND website=?", (user_id, channel_id, website))
         except sqlite3.Error as e:
             response = f"Error removing site from the database: {e}"
             return response
@@ -595,127 +562,180 @@ def remove_monitor_site(command_text, channel_id, user_id):
         return response
 
     
-def check_sites_in_db():
+# Uptime percentages and outage counts for a site over the last day, week, month and year
+def site_history(command_text):
+    website = (command_text or "").strip()
+    if not re.match(r"^(?!https?://)[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", website):
+        return "Please provide a valid website without the scheme (the http/https part) or path.\nExample: `/site-history subdomain.example.com`", "error"
+
+    lines = []
     try:
-        db = sqlite3.connect(db_path)
-        cursor = db.cursor()
-        cursor.execute("SELECT user_id, channel_id, website, api_key FROM monitor_sites")
-        sites = cursor.fetchall()
-        db.close()
+        for label, seconds in site_history_windows:
+            percentage, outages = history.uptime(website, seconds)
+            if percentage is None:
+                continue
+            lines.append(f"Last {label}: {percentage:.2f}% up, {outages} outage{'' if outages == 1 else 's'}")
     except sqlite3.Error as e:
         if debug_mode:
-            print(f"Error fetching sites from the database: {e}")
-        return "Error fetching sites from the database."
-    
-    if not sites:
-        return "No sites found in the database."
-    response = "Here is a list of sites and their current status:\n\n"
-
-    for site in sites:
-        user_id = site[0]
-        channel_id = site[1]
-        website = site[2]
-        api_key = site[3]
-        status = get_status(website, api_key, mode="response")
-        response += f"{status}\nAdded by: <@{user_id}>\nNotifications in: <#{channel_id}>)\n"
-        if site != sites[-1]:
-            response += "----------------------------------------------\n"
-    
-    return response
+            print(f"Error reading the status history: {e}")
+        return "Error reading the status history from the database.", "error"
+
+    if not lines:
+        return f"There's no history for {website} yet. History is collected for monitored sites and updated every hour.", "error"
+    return f"*Uptime for {website}*\n" + "\n".join(lines) + "\n_Updated every hour._"
+
+
+# Work out which sites /check-sites-in-db should include. Any of these can be combined:
+# a channel (#channel, or "here" for the current one), a user (@user) and "down" to only list sites
+# that aren't up. Returns the filters or an error message.
+def parse_check_filters(command_text, channel_id):
+    filters = {"channel_id": None, "user_id": None, "not_up": False}
+    for word in (command_text or "").split():
+        channel_match = re.match(r"^<#(\w+)(\|[^>]*)?>$", word)
+        user_match = re.match(r"^<@(\w+)(\|[^>]*)?>$", word)
+        if channel_match:
+            filters["channel_id"] = channel_match.group(1)
+        elif user_match:
+            filters["user_id"] = user_match.group(1)
+        elif word.lower() == "here":
+            filters["channel_id"] = channel_id
+        elif word.lower() in ("down", "not-up"):
+            filters["not_up"] = True
+        else:
+            return f"Unknown filter `{word}`. Usage: `/check-sites-in-db [#channel | here] [@user] [down]`"
+    return filters
+
+
+def site_result_block(site, monitor):
+    user_id, channel_id, website, api_key = site
+    if isinstance(monitor, dict):
+        status = monitor["status"]
+        friendly_status = friendly_statuses.get(status, "Unknown")
+        text = f"*{monitor['friendly_name']}*\nStatus: {friendly_status} (Status code: {status})\nURL: {monitor['url']}"
+    else:
+        text = f"*{website}*\n{monitor}"
+    return {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f"{text}\nAdded by: <@{user_id}>\nNotifications in: <#{channel_id}>"
+        }
+    }
+
 
+# Turn on push mode for an account and give the user the webhook URL to add to UptimeRobot
+def enable_webhook(command_text):
+    uptime_api_key = command_text.strip()
+    if not webhooks.public_url:
+        return "Webhooks aren't set up for this bot. Ask an admin to set PUBLIC_URL.", "error"
+
+    # Make sure the key works before handing out a webhook for it
+    if isinstance(get_monitors_page(uptime_api_key, 0), str):
+        return "There was an error when verifying your API key. Please check that it is correct.", "error"
 
-# Every minute this function will be run to check the status of all sites in the db and send a message to the channel for any that are down
-def scheduled_check():
     try:
-        db = sqlite3.connect(db_path)
-        cursor = db.cursor()
-        cursor.execute("SELECT user_id, channel_id, website, api_key, last_status FROM monitor_sites")
-        sites = cursor.fetchall()
-        db.close()
+        account_id, secret = webhooks.enable_account(uptime_api_key)
     except sqlite3.Error as e:
-        if debug_mode:
-            print(f"Error fetching sites from the database: {e}")
-        return "Error fetching sites from the database."
-    
-    if not sites:
-        print("No sites found in the database.")
-        return "No sites found in the database."
-
-    for site in sites:
-        user_id = site[0]
-        channel_id = site[1]
-        website = site[2]
-        api_key = site[3]
-        try:
-            last_status = int(site[4])
-        except (ValueError, TypeError):
-            last_status = 8  # If last_status is not an int, we assume the site seems down (status code 8)
-            print(f"Invalid last_status for site {website}. Setting to 8 (seems down).")
-        status = get_status(website, api_key, mode="plain")
-        if type(status) is not int:
-            status = 8  # If the status is not an int, we assume the site is down (status code 8)
-        
-        if status == last_status:
-            continue
-        else:
-            # Update the last status in the db
-            try:
-                db = sqlite3.connect(db_path)
-                cursor = db.cursor()
-                cursor.execute("UPDATE monitor_sites SET last_status=? WHERE user_id=? AND channel_id=? AND website=?", (status, user_id, channel_id, website))
-                db.commit()
-                db.close()
-            except sqlite3.Error as e:
-                if debug_mode:
-                    print(f"Error updating site status in the database: {e}")
-                return "Error updating site status in the database."
-
-        message = ""
-        if status == 0:
-            message = f"{website} has been paused."
-        elif status == 1:
-            message = f"{website} has not been checked yet."
-        elif status == 2:  # Up
-            message = f"Hey <@{user_id}>! Your site ({website}) is up and running!"
-        elif status == 8:
-            message = f"Hey <@{user_id}>! Your site ({website}) seems to be down."
-        elif status == 9:  # Down
-            message = f"Hey <@{user_id}>! Your site ({website}) is down."
-        else:
-            message = f"Hey <@{user_id}>! Your site ({website}) has an unknown status: {status}. Something seems to have gone wrong."
-            client.chat_postMessage(
-                channel="C094WP8REDT",
-                text=f"Unknown status for site {website} in channel <#{channel_id}>. Status code: {status}",
-                unfurl_links=False,
-                unfurl_media=False
-            )
+        return f"Error saving the webhook to the database: {e}", "error"
+
+    return (
+        "Push mode is on for this account. In UptimeRobot, add a *Webhook* alert contact with this URL:\n"
+        f"```{webhooks.webhook_url()}```\n"
+        "Tick *Send as JSON (application/json)*, set the *POST Value (JSON Format)* to the following and attach the alert contact to your monitors:\n"
+        f"```{webhooks.webhook_body(account_id, secret)}```\n"
+        f"Status changes are now posted as soon as UptimeRobot sends them, and the account is only polled every {webhook_reconcile_interval // 60} minutes "
+        "to catch anything missed. Running this command again replaces the secret."
+    )
 
-        print(message)
-        
-        client.chat_postMessage(
+
+def disable_webhook(command_text):
+    try:
+        updated = webhooks.disable_account(command_text.strip())
+    except sqlite3.Error as e:
+        return f"Error updating the database: {e}", "error"
+    if not updated:
+        return "Push mode isn't on for this API key.", "error"
+    return "Push mode is off for this account and its sites are polled every minute again. You can remove the webhook alert contact in UptimeRobot."
+
+
+# Check the sites in the db and post the results to the channel as they come in.
+# Sites are read from the db in batches, one UptimeRobot account after another. Each account's sites are
+# answered from their saved status when it's fresh and the rest are fetched together (see
+# uptime_robot.iter_monitors). The results are posted in messages of at most check_results_per_message sites
+# (well inside Slack's 50 block limit). A partly filled message is also sent if nothing has been posted for
+# check_results_flush_seconds so the first results show up quickly. The messages are spaced at least
+# outbox.outbox_channel_interval seconds apart, like the outbox spaces a channel's notifications.
+def check_sites_in_db(command_text, channel_id):
+    filters = parse_check_filters(command_text, channel_id)
+    if isinstance(filters, str):
+        return filters, "error"
+
+    query = "SELECT user_id, channel_id, website, api_key, monitor_id, last_status, monitor_url, last_checked_at FROM monitor_sites"
+    conditions = []
+    params = []
+    if filters["channel_id"]:
+        conditions.append("channel_id = ?")
+        params.append(filters["channel_id"])
+    if filters["user_id"]:
+        conditions.append("user_id = ?")
+        params.append(filters["user_id"])
+    if conditions:
+        # The filters' indexes find the rows, sorting them is cheaper than scanning the api_key index for them
+        # (the + keeps SQLite from using it)
+        query += " WHERE " + " AND ".join(conditions) + " ORDER BY +api_key"
+    else:
+        query += " ORDER BY api_key"
+
+    checked = 0
+    listed = 0
+    messages = 0
+    blocks = []
+    last_post = time.monotonic()
+
+    def post_results():
+        nonlocal blocks, last_post, messages
+        header = "Here is a list of sites and their current status:" if messages == 0 else "More sites:"
+        if messages:
+            time.sleep(max(0, last_post + outbox.outbox_channel_interval - time.monotonic()))
+        results_client.chat_postMessage(
             channel=channel_id,
-            text=message,
+            text=header,
+            blocks=[{"type": "section", "text": {"type": "mrkdwn", "text": header}}, {"type": "divider"}] + blocks,
             unfurl_links=False,
             unfurl_media=False
         )
-    if debug_mode:
-        print("Scheduled check completed.")
-    return
-
-def run_schedule():
-    client.chat_postMessage(
-        channel="C094WP8REDT",
-        text="Uptime robot bot schedule runner started.",
-        unfurl_links=False,
-        unfurl_media=False
-    )
-    while True:
-        schedule.run_pending()
-        time.sleep(0.5)
+        messages += 1
+        blocks = []
+        last_post = time.monotonic()
 
-
-# Schedule the check every 1 minute
-schedule.every().minute.at(":00").do(scheduled_check)
+    try:
+        sites = (
+            (row[2], row[3], row[4], fresh_saved_monitor(row[2], row[5], row[4], row[6], row[7]), tuple(row[:4]))
+            for row in db.iter_rows(query, params)
+        )
+        for site, monitor in iter_monitors(sites):
+            checked += 1
+            if filters["not_up"] and isinstance(monitor, dict) and monitor["status"] == 2:
+                continue
+            listed += 1
+            blocks.append(site_result_block(site, monitor))
+            if len(blocks) >= check_results_per_message or time.monotonic() - last_post >= check_results_flush_seconds:
+                post_results()
+        if blocks:
+            post_results()
+    except sqlite3.Error as e:
+        if debug_mode:
+            print(f"Error fetching sites from the database: {e}")
+        return "Error fetching sites from the database.", "error"
+    except SlackApiError as e:
+        print(f"Error posting /check-sites-in-db results: {e}")
+        return f"Error posting the results to the channel ({e.response.get('error', 'unknown error')}) after {messages} messages. Please try again in a minute.", "error"
+
+    if checked == 0:
+        return "No sites found in the database.", "error"
+    if listed == 0:
+        return f"All {checked} sites checked are up."
+    return f"Checked {checked} sites, {listed} listed above."
 
 
 if __name__ == "__main__":
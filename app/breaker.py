@@ -0,0 +1,80 @@
+import threading
+import time
+
+
+# Circuit breakers for UptimeRobot.
+# A breaker opens after failure_threshold failures in a row and then turns calls away straight away for
+# reset_timeout seconds. After that one trial call is let through: if it works the breaker closes again,
+# if it fails the breaker stays open for another reset_timeout. This stops a struggling upstream (or a
+# broken API key) from being hammered and keeps every caller from waiting on timeouts.
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self.rejected = 0
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    # Whether a call may go ahead. Half open breakers let one trial call through per reset_timeout, so a
+    # trial that never reports back doesn't keep the breaker open for good.
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            trial_due = self.trial_started_at is None or now - self.trial_started_at >= self.reset_timeout
+            if now - self.opened_at >= self.reset_timeout and trial_due:
+                self.trial_started_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"UptimeRobot circuit breaker {self.name} closed.")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.opened_at is not None:
+                # The trial call failed, stay open for another reset_timeout
+                self.opened_at = time.monotonic()
+                self.trial_started_at = None
+            elif self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                print(f"UptimeRobot circuit breaker {self.name} opened after {self.failures} failures in a row.")
+
+
+# One breaker per API key, created as they're first used
+class BreakerGroup:
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            breaker = self.breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(f"{self.name} ...{key[-4:]}", self.failure_threshold, self.reset_timeout)
+                self.breakers[key] = breaker
+            return breaker
+
+    def open_count(self):
+        with self.lock:
+            return sum(1 for breaker in self.breakers.values() if breaker.is_open)
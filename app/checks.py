@@ -0,0 +1,390 @@
+from dotenv import load_dotenv
+import threading
+import time
+import sqlite3
+import os
+from uptime_robot import stream_account_monitors, index_monitors, cache_monitors, check_cycle_deadline
+from status_cache import monitor_cache
+from jobs import home_jobs
+from scheduler import SiteScheduler, schedule_interval
+from leases import RunnerLease
+from pipeline import Pipeline, Stage
+import db
+import outbox
+import home
+import metrics
+import history
+import digest
+import profiling
+
+
+# Checking sites and announcing their status changes.
+# Used by both the web app (for the webhook and the dev server's scheduler thread) and scheduler_runner.py.
+# It doesn't need Flask or the Slack events adapter, so a schedule runner only loads what it uses.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+db_path = os.getenv("DB_PATH")
+
+slack_bot_token = os.getenv("SLACK_BOT_TOKEN")
+slack_api_url = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+
+# Accounts that can wait between two stages of a check cycle, and the sites saved per transaction
+check_pipeline_queue_size = int(os.getenv("CHECK_PIPELINE_QUEUE_SIZE", 50))
+check_save_batch_size = int(os.getenv("CHECK_SAVE_BATCH_SIZE", 500))
+# Seconds between the log lines summing up the checks. Each check only gets its own line in debug mode.
+check_summary_interval = float(os.getenv("CHECK_SUMMARY_INTERVAL", 60))
+
+# Check if required environment variables are set
+if not slack_bot_token:
+    raise ValueError("SLACK_BOT_TOKEN environment variable is not set.")
+
+if not db_path:
+    raise ValueError("DB_PATH environment variable is not set.")
+
+client = metrics.InstrumentedWebClient(token=slack_bot_token, base_url=slack_api_url)
+
+
+# Check the given monitor_sites rows (user_id, channel_id, website, api_key, last_status, monitor_id), save any
+# status changes and queue their notifications. Returns {(user_id, channel_id, website): status} for every site
+# checked. Sites whose account couldn't be fetched (an error, an open circuit breaker or the cycle deadline
+# passing) or whose changes couldn't be saved aren't checked: they're left out, and the ones whose account
+# couldn't be fetched are marked as not checked.
+def check_sites(sites):
+    statuses = {}
+    run_check(sorted(sites, key=lambda site: site[3] or ""), statuses)
+    return statuses
+
+
+# A check cycle runs as a pipeline of stages (see pipeline.py):
+#   accounts: group the rows, which have to be in api_key order, into one item per UptimeRobot account
+#   fetch: get the monitors of each account, several accounts at a time
+#   diff: work out which sites changed status
+#   save: save the changes, when each site was checked (or why it couldn't be) and queue the notifications,
+#         a batch at a time
+# Only a few accounts are between stages at any time, so a check never holds the monitors of every account
+# at once. The rows themselves come from the scheduler, which keeps an entry for every site it schedules.
+# The pipeline (see check_pipeline below) is kept for the life of the process and each check is a run of it.
+# The statuses of the sites that were checked are added to statuses if it's given.
+def run_check(rows, statuses=None):
+    cycle_start = time.monotonic()
+    check = check_pipeline
+    stages = check.stages
+
+    checked = 0
+    skipped = 0
+    profile = profiling.start("cycle", "check")
+    try:
+        for account_statuses, account_skipped in check.run(rows, cycle_start + check_cycle_deadline):
+            checked += len(account_statuses)
+            skipped += account_skipped
+            if statuses is not None:
+                statuses.update(account_statuses)
+    finally:
+        profiling.finish(profile)
+
+    if debug_mode:
+        print("Scheduled check completed.")
+
+    site_count = checked + skipped
+    cycle_duration = time.monotonic() - cycle_start
+    metrics.check_cycle_seconds.observe(cycle_duration)
+    metrics.check_cycle_sites.inc(amount=checked)
+    metrics.check_cycle_skipped_sites.inc(amount=skipped)
+    if debug_mode:
+        print(f"Scheduled check of {site_count} sites across {stages[1].items} accounts took {cycle_duration:.2f}s ({check.report()}).")
+    check_summary.add(site_count, skipped, stages[1].items, cycle_duration)
+    if skipped:
+        print(f"{skipped} sites weren't checked because their UptimeRobot account couldn't be fetched or compared, or their changes couldn't be saved. The App Home shows them as not checked until they are.")
+    if debug_mode:
+        print(f"Slack outbox: {outbox.stats()}")
+        print(f"Status cache: {monitor_cache.stats()}")
+    if cycle_duration > schedule_interval:
+        print(f"Warning: checking {site_count} sites took longer than the {schedule_interval}s check interval.")
+
+
+# Sums up the checks for the logs. The scheduler usually checks one account at a time, so a line per check
+# would be a line per account per interval.
+class CheckSummary:
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.reset(time.monotonic())
+
+    def reset(self, now):
+        self.started = now
+        self.checks = 0
+        self.sites = 0
+        self.skipped = 0
+        self.accounts = 0
+        self.slowest = 0.0
+
+    # Add a check and print the summary if it's due
+    def add(self, sites, skipped, accounts, duration):
+        with self.lock:
+            self.checks += 1
+            self.sites += sites
+            self.skipped += skipped
+            self.accounts += accounts
+            self.slowest = max(self.slowest, duration)
+            now = time.monotonic()
+            if now - self.started < self.interval:
+                return
+            print(f"{self.checks} scheduled checks of {self.sites} sites across {self.accounts} accounts in the last {now - self.started:.0f}s, {self.skipped} sites skipped, slowest check {self.slowest:.2f}s.")
+            self.reset(now)
+
+
+check_summary = CheckSummary(check_summary_interval)
+
+
+def group_accounts(rows):
+    api_key = None
+    sites = []
+    for row in rows:
+        if sites and row[3] != api_key:
+            yield api_key, sites
+            sites = []
+        api_key = row[3]
+        sites.append(row)
+    if sites:
+        yield api_key, sites
+
+
+# One getMonitors call per account instead of one per site. Accounts whose sites all have a monitor id only
+# have those monitors requested. For the rest every monitor on the account is fetched and the sites are
+# matched by name, which also fills in their ids. The run's context is the cycle's deadline.
+def fetch_accounts(accounts):
+    requests = (
+        (api_key, sorted({site[5] for site in sites}) if all(site[5] is not None for site in sites) else None, sites)
+        for api_key, sites in accounts
+    )
+    yield from stream_account_monitors(requests, check_pipeline.context, interactive=False)
+
+
+# Yields (api_key, sites, statuses, changes, checked) for each account, with an error string in place of the
+# statuses if the account couldn't be fetched or its monitors couldn't be compared (eg. a malformed monitor).
+# checked is (monitor url, monitor id, user_id, channel_id, website) for every site whose monitor was found.
+# An error in one account doesn't stop the others, and its sites are still marked as not checked.
+def diff_accounts(accounts):
+    for api_key, sites, monitors in accounts:
+        if not isinstance(monitors, list):
+            if debug_mode:
+                print(monitors)
+            yield api_key, sites, monitors, [], []
+            continue
+        try:
+            diffed = diff_account(api_key, sites, monitors)
+        except Exception as e:
+            metrics.check_account_errors.inc("diff")
+            print(f"Error comparing the monitors of API key ...{(api_key or '')[-4:]}: {e}")
+            diffed = api_key, sites, f"Error comparing the account's monitors: {e}", [], []
+        yield diffed
+
+
+def diff_account(api_key, sites, monitors):
+    by_id = {monitor.get("id"): monitor for monitor in monitors}
+    by_website = index_monitors(monitors)
+    statuses = {}
+    changes = []
+    matched = {}
+    checked = []
+    for site in sites:
+        user_id = site[0]
+        channel_id = site[1]
+        website = site[2]
+        try:
+            last_status = int(site[4])
+        except (ValueError, TypeError):
+            last_status = 8  # If last_status is not an int, we assume the site seems down (status code 8)
+            print(f"Invalid last_status for site {website}. Setting to 8 (seems down).")
+        monitor_id = site[5]
+        monitor = by_id.get(monitor_id) if monitor_id is not None else by_website.get(website)
+        if monitor:
+            matched[website] = monitor
+            checked.append((monitor.get("url"), monitor.get("id"), user_id, channel_id, website))
+        status = monitor["status"] if monitor else None
+        if type(status) is not int:
+            status = 8  # If the monitor is missing from the account or has no status, we assume the site is down (status code 8)
+
+        statuses[(user_id, channel_id, website)] = status
+        if status != last_status:
+            changes.append((status, user_id, channel_id, website, site[4]))
+
+    if matched:
+        cache_monitors(api_key, matched, list(matched))
+    return api_key, sites, statuses, changes, checked
+
+
+# Yields (statuses, skipped site count) for each account. Accounts are saved in batches of about
+# check_save_batch_size sites. If saving a batch fails its accounts are marked as not checked and the
+# next batch is saved as usual.
+def save_accounts(accounts):
+    batch = []
+    batch_size = 0
+    for account in accounts:
+        batch.append(account)
+        batch_size += len(account[1])
+        if batch_size >= check_save_batch_size:
+            yield from save_batch(batch)
+            batch = []
+            batch_size = 0
+    if batch:
+        yield from save_batch(batch)
+
+
+def save_batch(batch):
+    try:
+        results = save_accounts_batch(batch)
+    except Exception as e:
+        metrics.check_account_errors.inc("save", amount=len(batch))
+        print(f"Error saving the check of {len(batch)} accounts: {e}")
+        record_not_checked([(api_key, sites, f"Error saving the check: {e}", [], []) for api_key, sites, *_ in batch])
+        results = [({}, len(account[1])) for account in batch]
+    yield from results
+
+
+def save_accounts_batch(batch):
+    fetched = [account for account in batch if not isinstance(account[2], str)]
+    failed = [account for account in batch if isinstance(account[2], str)]
+    changes = [change for _, _, _, account_changes, _ in fetched for change in account_changes]
+    saved = save_status_changes(changes) if changes else []
+    if isinstance(saved, str):
+        print(saved)
+    else:
+        record_checked(fetched)
+    record_not_checked(failed)
+    return [({}, len(sites)) if isinstance(statuses, str) or isinstance(saved, str) else (statuses, 0) for _, sites, statuses, _, _ in batch]
+
+
+check_pipeline = Pipeline("check", [
+    Stage("accounts", group_accounts),
+    Stage("fetch", fetch_accounts),
+    Stage("diff", diff_accounts),
+    Stage("save", save_accounts),
+], check_pipeline_queue_size)
+
+
+# Record when the sites of the fetched accounts were checked, so the web app can answer commands with their
+# saved status (see uptime_robot.get_monitor), and store the ids of sites that were matched by name so their
+# account can be polled by id from now on. Sites that couldn't be checked last time are checked again now.
+# Only done once the changes are saved, so a saved status is never newer than it looks.
+def record_checked(accounts):
+    if not accounts:
+        return
+    now = time.time()
+    checked = [(now, *site) for _, _, _, _, account_checked in accounts for site in account_checked]
+    statuses = {key for _, _, account_statuses, _, _ in accounts for key in account_statuses}
+    api_keys = sorted({account[0] for account in accounts})
+    placeholders = ", ".join("?" for _ in api_keys)
+    try:
+        with db.transaction() as conn:
+            conn.executemany("UPDATE monitor_sites SET last_checked_at=?, monitor_url=?, monitor_id=COALESCE(monitor_id, ?) WHERE user_id=? AND channel_id=? AND website=?", checked)
+            not_checked = conn.execute(
+                f"SELECT user_id, channel_id, website FROM monitor_sites WHERE check_error IS NOT NULL AND api_key IN ({placeholders})",
+                api_keys
+            ).fetchall()
+            cleared = [tuple(site) for site in not_checked if tuple(site) in statuses]
+            conn.executemany("UPDATE monitor_sites SET check_error=NULL WHERE user_id=? AND channel_id=? AND website=?", cleared)
+    except sqlite3.Error as e:
+        print(f"Error saving check times: {e}")
+        return
+    if cleared:
+        home_jobs.submit(home.republish_homes, [site[0] for site in cleared], client)
+
+
+# Mark the sites of accounts that couldn't be fetched as not checked, so they're shown that way instead of
+# with a status that may be out of date
+def record_not_checked(accounts):
+    if not accounts:
+        return
+    marked = set()
+    try:
+        with db.transaction() as conn:
+            for api_key, sites, error, _, _ in accounts:
+                for site in sites:
+                    if conn.execute("UPDATE monitor_sites SET check_error=? WHERE user_id=? AND channel_id=? AND website=? AND check_error IS NULL", (error, *site[:3])).rowcount:
+                        marked.add(site[0])
+    except sqlite3.Error as e:
+        print(f"Error marking sites as not checked: {e}")
+        return
+    if marked:
+        home_jobs.submit(home.republish_homes, marked, client)
+
+
+# Save status changes and queue their notifications. Used by the scheduled checks and the UptimeRobot webhook.
+# changes is a list of (status, user_id, channel_id, website, last_status) tuples. Returns the changes that
+# were applied or an error message.
+def save_status_changes(changes):
+    # Save all of the changes and queue their notifications in one transaction. If that fails nothing is
+    # queued, so the same changes are picked up and announced on the next run instead of being lost or
+    # announced twice. A change is only saved (and announced) if the row still has the status we read,
+    # so if two schedule runners (or a runner and the webhook) see the same change only one of them posts it.
+    # The outbox worker does the actual posting to Slack.
+    try:
+        with db.transaction() as conn:
+            changes = db.update_statuses(changes, conn)
+            for change in changes:
+                metrics.status_transitions.inc(change[4], change[0])
+            history.record_changes(changes, conn)
+            # Channels with a lot of changes at once get a single digest message instead (see digest.py)
+            announced = digest.hold_changes(changes, conn)
+            outbox.enqueue_many(status_change_messages(announced), conn)
+            outbox.enqueue_many(unknown_status_messages([change for change in changes if change not in announced]), conn)
+    except sqlite3.Error as e:
+        if debug_mode:
+            print(f"Error updating site statuses in the database: {e}")
+        return "Error updating site status in the database."
+
+    # Keep the App Home of everyone whose sites changed up to date
+    if changes:
+        home_jobs.submit(home.republish_homes, [change[1] for change in changes], client)
+    return changes
+
+
+# Build the Slack messages for a list of (status, user_id, channel_id, website, ...) status changes
+def status_change_messages(changes):
+    messages = []
+    for status, user_id, channel_id, website, *_ in changes:
+        message = ""
+        if status == 0:
+            message = f"{website} has been paused."
+        elif status == 1:
+            message = f"{website} has not been checked yet."
+        elif status == 2:  # Up
+            message = f"Hey <@{user_id}>! Your site ({website}) is up and running!"
+        elif status == 8:
+            message = f"Hey <@{user_id}>! Your site ({website}) seems to be down."
+        elif status == 9:  # Down
+            message = f"Hey <@{user_id}>! Your site ({website}) is down."
+        else:
+            message = f"Hey <@{user_id}>! Your site ({website}) has an unknown status: {status}. Something seems to have gone wrong."
+            messages.extend(unknown_status_messages([(status, user_id, channel_id, website)]))
+
+        print(message)
+        messages.append((channel_id, message))
+    return messages
+
+
+# Let the admin channel know about any statuses we don't understand
+def unknown_status_messages(changes):
+    return [
+        ("C094WP8REDT", f"Unknown status for site {website} in channel <#{channel_id}>. Status code: {status}")
+        for status, user_id, channel_id, website, *_ in changes
+        if status not in (0, 1, 2, 8, 9)
+    ]
+
+
+# Any number of these can run at once (in separate schedule runner processes and/or the dev server).
+# They share the sites and the outbox between them through leases in the db.
+def run_schedule():
+    metrics.start_metrics_server()
+    lease = RunnerLease().start()
+    outbox.start_delivery_worker(client, lease)
+    history.start_rollup_worker()
+    digest.start_flush_worker(lease)
+    outbox.enqueue("C094WP8REDT", f"Uptime robot bot schedule runner started ({lease.runner_id}).")
+    SiteScheduler(check_sites, lease).run()
+
+
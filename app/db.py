@@ -0,0 +1,134 @@
+from dotenv import load_dotenv
+from contextlib import contextmanager
+import threading
+import time
+import sqlite3
+import os
+from metrics import db_query_seconds
+import profiling
+
+
+# Small data access layer shared by the web app and the scheduler runner.
+# Each thread keeps one connection open for its lifetime instead of connecting on every query. The db is
+# put in WAL mode so the web process can keep reading while the scheduler writes, and writers wait on
+# the busy timeout instead of failing straight away with "database is locked".
+
+load_dotenv()
+
+db_path = os.getenv("DB_PATH")
+
+# How long (ms) a connection waits for a lock held by another process before giving up
+db_busy_timeout = int(os.getenv("DB_BUSY_TIMEOUT", 5000))
+
+_local = threading.local()
+
+
+def connect():
+    conn = sqlite3.connect(db_path, timeout=db_busy_timeout / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={db_busy_timeout}")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Safe in WAL mode and avoids an fsync on every commit
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-8000")  # ~8MB page cache
+    return conn
+
+
+# Get this thread's connection, opening it the first time it's needed
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+    return conn
+
+
+def close_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+# The first word of the query (select, insert...) labels its metrics
+def query_operation(query):
+    return query.lstrip().split(None, 1)[0].lower()
+
+
+# Run the block in a single transaction, committing at the end or rolling back if anything raised
+@contextmanager
+def transaction():
+    conn = get_connection()
+    start = time.perf_counter()
+    try:
+        with profiling.phase("db"):
+            yield conn
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        db_query_seconds.observe(time.perf_counter() - start, "transaction")
+
+
+def fetch_all(query, params=()):
+    with db_query_seconds.time(query_operation(query)), profiling.phase("db"):
+        return get_connection().execute(query, params).fetchall()
+
+
+def fetch_one(query, params=()):
+    with db_query_seconds.time(query_operation(query)), profiling.phase("db"):
+        return get_connection().execute(query, params).fetchone()
+
+
+# Yield rows a batch at a time instead of loading the whole result into memory. The time spent running the
+# query and fetching the batches (not the time the caller spends on the rows) is recorded as one query once
+# the rows have been read or the caller stops.
+def iter_rows(query, params=(), batch_size=500):
+    start = time.perf_counter()
+    with profiling.phase("db"):
+        cursor = get_connection().execute(query, params)
+    seconds = time.perf_counter() - start
+    try:
+        while True:
+            start = time.perf_counter()
+            with profiling.phase("db"):
+                rows = cursor.fetchmany(batch_size)
+            seconds += time.perf_counter() - start
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+        db_query_seconds.observe(seconds, query_operation(query))
+
+
+def execute(query, params=()):
+    with db_query_seconds.time(query_operation(query)), transaction() as conn:
+        return conn.execute(query, params).rowcount
+
+
+def execute_many(query, params_list):
+    with db_query_seconds.time(query_operation(query)), transaction() as conn:
+        return conn.executemany(query, params_list).rowcount
+
+
+# Write every status change from a check cycle in one transaction.
+# changes is a list of (status, user_id, channel_id, website, last_status) tuples where last_status is the
+# value that was read from the row. A row is only updated if it still has that value, so a change that
+# someone else already saved isn't applied (or announced) twice. The status is current, so last_checked_at
+# is set and any check error cleared as well. Returns the changes that were applied.
+# Pass conn to write them as part of a transaction that's already open.
+def update_statuses(changes, conn=None):
+    if not changes:
+        return []
+    if conn is None:
+        with transaction() as conn:
+            return update_statuses(changes, conn)
+
+    applied = []
+    now = time.time()
+    for change in changes:
+        cursor = conn.execute("UPDATE monitor_sites SET last_status=?, last_checked_at=?, check_error=NULL WHERE user_id=? AND channel_id=? AND website=? AND last_status IS ?", (change[0], now, *change[1:]))
+        if cursor.rowcount:
+            applied.append(change)
+    return applied
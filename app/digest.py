@@ -0,0 +1,158 @@
+from dotenv import load_dotenv
+import threading
+import sqlite3
+import time
+import os
+import db
+import outbox
+import profiling
+from uptime_robot import friendly_statuses
+
+
+# Digest mode for mass outages.
+# When more than DIGEST_THRESHOLD sites in one channel change status within DIGEST_HOLD_SECONDS, the changes
+# from then on are held in the digest_pending table instead of being posted one message per site. Changes are
+# counted in the digest_recent_changes table rather than per save, since a channel's sites can be checked in
+# separate batches (or pushed by webhooks one at a time) during the same outage. DIGEST_HOLD_SECONDS after
+# the first held change the channel gets a single message listing every held change, grouped into down,
+# recovered and other sites. Later changes in the channel join the held digest while it's waiting, and a
+# site that changes back to where it started before the digest is sent drops out of it, so flapping sites
+# don't show up at all.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+# 0 turns digest mode off
+digest_threshold = int(os.getenv("DIGEST_THRESHOLD", 0))
+digest_hold_seconds = float(os.getenv("DIGEST_HOLD_SECONDS", 120))
+# Sites listed per group in a digest, the rest are counted
+digest_max_listed = 100
+
+
+# Hold the changes of every channel that's in digest mode. changes is a list of (status, user_id, channel_id,
+# website, last_status) tuples that have just been saved. Returns the changes to announce one by one.
+def hold_changes(changes, conn):
+    if not digest_threshold or not changes:
+        return changes
+
+    now = time.time()
+    changes_by_channel = {}
+    for change in changes:
+        changes_by_channel.setdefault(change[2], []).append(change)
+    conn.execute("DELETE FROM digest_recent_changes WHERE changed_at < ?", (now - digest_hold_seconds,))
+    conn.executemany("INSERT INTO digest_recent_changes (channel_id, changed_at) VALUES (?, ?)", [(change[2], now) for change in changes])
+    recent_counts = dict(conn.execute("SELECT channel_id, COUNT(*) FROM digest_recent_changes GROUP BY channel_id"))
+    held_channels = {row[0] for row in conn.execute("SELECT DISTINCT channel_id FROM digest_pending")}
+
+    individual = []
+    for channel_id, channel_changes in changes_by_channel.items():
+        if recent_counts.get(channel_id, 0) <= digest_threshold and channel_id not in held_channels:
+            individual.extend(channel_changes)
+            continue
+        for status, user_id, channel_id, website, last_status in channel_changes:
+            held = conn.execute(
+                "SELECT id, from_status FROM digest_pending WHERE channel_id = ? AND user_id = ? AND website = ?",
+                (channel_id, user_id, website)
+            ).fetchone()
+            if held is None:
+                conn.execute(
+                    "INSERT INTO digest_pending (channel_id, user_id, website, from_status, to_status, held_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (channel_id, user_id, website, last_status, status, now)
+                )
+            elif str(held[1]) == str(status):
+                conn.execute("DELETE FROM digest_pending WHERE id = ?", (held[0],))  # Flapped back, nothing to report
+            else:
+                conn.execute("UPDATE digest_pending SET to_status = ? WHERE id = ?", (status, held[0]))
+    return individual
+
+
+def site_lines(rows, show_status=False):
+    lines = [f"• {website} (<@{user_id}>)" + (f": {friendly_statuses.get(status, 'Unknown')} (status code {status})" if show_status else "") for user_id, website, status in rows[:digest_max_listed]]
+    if len(rows) > digest_max_listed:
+        lines.append(f"…and {len(rows) - digest_max_listed} more")
+    return lines
+
+
+# Section blocks with a title and a list of lines, split to stay under Slack's 3000 character limit
+def list_sections(title, lines):
+    sections = []
+    text = f"*{title}*"
+    for line in lines:
+        if len(text) + len(line) + 1 > 2900:
+            sections.append({"type": "section", "text": {"type": "mrkdwn", "text": text}})
+            text = ""
+        text = f"{text}\n{line}" if text else line
+    sections.append({"type": "section", "text": {"type": "mrkdwn", "text": text}})
+    return sections
+
+
+# Build the digest message for a channel from its held (user_id, website, to_status) rows.
+# Returns (fallback text, blocks).
+def build_digest(rows):
+    down = [row for row in rows if row[2] in (8, 9)]
+    up = [row for row in rows if row[2] == 2]
+    other = [row for row in rows if row[2] not in (2, 8, 9)]
+
+    summary = []
+    if down:
+        summary.append(f"{len(down)} down")
+    if up:
+        summary.append(f"{len(up)} recovered")
+    if other:
+        summary.append(f"{len(other)} other")
+    text = f"{len(rows)} sites changed status: {', '.join(summary)}."
+
+    blocks = [{"type": "section", "text": {"type": "mrkdwn", "text": f":rotating_light: *{text}*"}}]
+    if down:
+        blocks.append({"type": "divider"})
+        blocks.extend(list_sections(f"Down ({len(down)})", site_lines(down)))
+    if up:
+        blocks.append({"type": "divider"})
+        blocks.extend(list_sections(f"Recovered ({len(up)})", site_lines(up)))
+    if other:
+        blocks.append({"type": "divider"})
+        blocks.extend(list_sections(f"Other ({len(other)})", site_lines(other, show_status=True)))
+    return text, blocks
+
+
+# Queue the digest of every channel whose hold window is over. lease is an optional leases.RunnerLease,
+# with one only the channels this runner delivers to are sent.
+def flush_due(lease=None):
+    now = time.time()
+    channels = db.fetch_all("SELECT channel_id, MIN(held_at) FROM digest_pending GROUP BY channel_id")
+    sent = 0
+    for channel_id, held_at in channels:
+        if held_at + digest_hold_seconds > now:
+            continue
+        if lease and not lease.owns(channel_id):
+            continue
+        with db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, user_id, website, to_status FROM digest_pending WHERE channel_id = ? ORDER BY website",
+                (channel_id,)
+            ).fetchall()
+            if not rows:
+                continue
+            conn.executemany("DELETE FROM digest_pending WHERE id = ?", [(row[0],) for row in rows])
+            with profiling.phase("blocks"):
+                text, blocks = build_digest([row[1:] for row in rows])
+            outbox.enqueue_many([(channel_id, text, blocks)], conn)
+        sent += 1
+        if debug_mode:
+            print(f"Queued a digest of {len(rows)} status changes for channel {channel_id}.")
+    return sent
+
+
+def run_flush(lease=None):
+    while True:
+        try:
+            flush_due(lease)
+        except sqlite3.Error as e:
+            print(f"Error sending status change digests: {e}")
+        time.sleep(1)
+
+
+def start_flush_worker(lease=None):
+    if digest_threshold:
+        threading.Thread(target=run_flush, args=(lease,), daemon=True, name="digests").start()
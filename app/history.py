@@ -0,0 +1,173 @@
+from dotenv import load_dotenv
+import threading
+import sqlite3
+import time
+import os
+import db
+
+
+# Status history and uptime rollups.
+# Every saved status change is appended to the status_history table. A rollup worker in the schedule runner
+# turns that into hourly and daily totals per website in status_rollups, one hour at a time, and old rows
+# of both tables are deleted after their retention period. Uptime reports only read status_rollups, so a
+# report is a couple of index range scans no matter how much history there is.
+#
+# Up means status 2, down means 8 or 9. Paused (0) and not checked yet (1) time isn't counted either way.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+# How often the rollup worker looks for finished hours to roll up
+history_rollup_interval = int(os.getenv("HISTORY_ROLLUP_INTERVAL", 300))
+history_raw_retention_days = int(os.getenv("HISTORY_RAW_RETENTION_DAYS", 30))
+history_hourly_retention_days = int(os.getenv("HISTORY_HOURLY_RETENTION_DAYS", 35))
+history_daily_retention_days = int(os.getenv("HISTORY_DAILY_RETENTION_DAYS", 400))
+
+hour = 3600
+day = 86400
+
+up_statuses = (2,)
+down_statuses = (8, 9)
+
+
+def to_int(status):
+    try:
+        return int(status)
+    except (ValueError, TypeError):
+        return None
+
+
+# Append saved status changes to the history. changes is a list of (status, user_id, channel_id, website,
+# last_status) tuples. A website added in several channels changes once per row, but is only recorded once.
+def record_changes(changes, conn):
+    now = time.time()
+    rows = {}
+    for status, user_id, channel_id, website, last_status in changes:
+        rows[(website, status)] = (website, to_int(last_status), status, now)
+    conn.executemany("INSERT INTO status_history (website, from_status, to_status, changed_at) VALUES (?, ?, ?, ?)", list(rows.values()))
+
+
+# Roll up the hour starting at start. Returns False if another runner rolled it up first.
+def roll_up_hour(start):
+    end = start + hour
+    with db.transaction() as conn:
+        rolled_until = conn.execute("SELECT value FROM status_rollup_meta WHERE name = 'rolled_until'").fetchone()
+        if rolled_until is None or rolled_until[0] != start:
+            return False
+
+        # Websites that are monitored now or changed during the hour start out with their status from the
+        # end of the last hour. Ones we haven't seen before start with the status they had before their
+        # first change, or their current status if they didn't change.
+        statuses = dict(conn.execute("SELECT website, status FROM status_rollup_state"))
+        current = {}
+        for website, last_status in conn.execute("SELECT website, last_status FROM monitor_sites"):
+            current.setdefault(website, to_int(last_status))
+        changes = conn.execute(
+            "SELECT website, from_status, to_status, changed_at FROM status_history WHERE changed_at >= ? AND changed_at < ? ORDER BY changed_at, id",
+            (start, end)
+        ).fetchall()
+        for website, from_status, to_status, changed_at in changes:
+            if website not in statuses:
+                statuses[website] = from_status
+        for website, status in current.items():
+            statuses.setdefault(website, status)
+        changed_websites = {change[0] for change in changes}
+        statuses = {website: status for website, status in statuses.items() if website in current or website in changed_websites}
+
+        totals = {website: [0.0, 0.0, 0] for website in statuses}
+        since = dict.fromkeys(statuses, start)
+
+        def add_time(website, until):
+            status = statuses[website]
+            if status in up_statuses:
+                totals[website][0] += until - since[website]
+            elif status in down_statuses:
+                totals[website][1] += until - since[website]
+            since[website] = until
+
+        for website, from_status, to_status, changed_at in changes:
+            add_time(website, changed_at)
+            if to_status in down_statuses and statuses[website] not in down_statuses:
+                totals[website][2] += 1
+            statuses[website] = to_status
+        for website in statuses:
+            add_time(website, end)
+
+        day_start = start - start % day
+        rows = [(website, up, down, outages) for website, (up, down, outages) in totals.items()]
+        conn.executemany(
+            f"INSERT INTO status_rollups (website, period, period_start, up_seconds, down_seconds, outages) VALUES (?, {hour}, {start}, ?, ?, ?) "
+            "ON CONFLICT (website, period, period_start) DO UPDATE SET up_seconds = excluded.up_seconds, down_seconds = excluded.down_seconds, outages = excluded.outages",
+            rows
+        )
+        # The daily totals are added up an hour at a time
+        conn.executemany(
+            f"INSERT INTO status_rollups (website, period, period_start, up_seconds, down_seconds, outages) VALUES (?, {day}, {day_start}, ?, ?, ?) "
+            "ON CONFLICT (website, period, period_start) DO UPDATE SET up_seconds = up_seconds + excluded.up_seconds, "
+            "down_seconds = down_seconds + excluded.down_seconds, outages = outages + excluded.outages",
+            rows
+        )
+        conn.execute("DELETE FROM status_rollup_state")
+        conn.executemany("INSERT INTO status_rollup_state (website, status) VALUES (?, ?)", statuses.items())
+        conn.execute("UPDATE status_rollup_meta SET value = ? WHERE name = 'rolled_until'", (end,))
+    return True
+
+
+# Roll up every finished hour that hasn't been yet. History starts at the beginning of the hour the
+# first rollup runs in.
+def roll_up(now=None):
+    now = now or time.time()
+    current_hour = int(now - now % hour)
+    db.execute("INSERT OR IGNORE INTO status_rollup_meta (name, value) VALUES ('rolled_until', ?)", (current_hour,))
+    rolled = 0
+    while True:
+        start = int(db.fetch_one("SELECT value FROM status_rollup_meta WHERE name = 'rolled_until'")[0])
+        if start + hour > now:
+            break
+        if roll_up_hour(start):
+            rolled += 1
+    if rolled and debug_mode:
+        print(f"Rolled up {rolled} hours of status history.")
+    return rolled
+
+
+def prune(now=None):
+    now = now or time.time()
+    rolled_until = db.fetch_one("SELECT value FROM status_rollup_meta WHERE name = 'rolled_until'")
+    if rolled_until is None:
+        return
+    # Raw changes are only deleted once they've been rolled up
+    db.execute("DELETE FROM status_history WHERE changed_at < ?", (min(now - history_raw_retention_days * day, rolled_until[0]),))
+    db.execute(f"DELETE FROM status_rollups WHERE period = {hour} AND period_start < ?", (now - history_hourly_retention_days * day,))
+    db.execute(f"DELETE FROM status_rollups WHERE period = {day} AND period_start < ?", (now - history_daily_retention_days * day,))
+
+
+def run_rollups():
+    while True:
+        try:
+            roll_up()
+            prune()
+        except sqlite3.Error as e:
+            print(f"Error rolling up the status history: {e}")
+        time.sleep(history_rollup_interval)
+
+
+def start_rollup_worker():
+    threading.Thread(target=run_rollups, daemon=True, name="status-rollups").start()
+
+
+# Uptime of a website over the last `seconds`, from the hourly rollups for windows of up to two days and
+# the daily ones for longer. Returns (uptime percentage or None if there's no data, outages).
+def uptime(website, seconds, now=None):
+    now = now or time.time()
+    period = hour if seconds <= 2 * day else day
+    since = now - seconds
+    since -= since % period
+    up, down, outages = db.fetch_one(
+        "SELECT SUM(up_seconds), SUM(down_seconds), SUM(outages) FROM status_rollups WHERE website = ? AND period = ? AND period_start >= ?",
+        (website, period, since)
+    )
+    if not up and not down:
+        return None, outages or 0
+    return 100 * up / (up + down), outages or 0
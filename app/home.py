@@ -0,0 +1,201 @@
+from dotenv import load_dotenv
+from slack_sdk.errors import SlackApiError
+import hashlib
+import sqlite3
+import json
+import time
+import os
+import db
+import profiling
+
+
+# App Home rendering.
+# The blocks for a user's Home tab are hashed and the hash of the last view published for them is kept
+# in the home_views table. A view is only sent to views.publish when its hash has changed, so opening the
+# Home tab is usually just one DB query, and the scheduler can keep everyone's Home tab up to date by
+# republishing only the users whose sites changed status.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+# How many users' sites are loaded per query when republishing in bulk
+home_batch_size = 200
+
+
+def build_home_blocks(rows):
+    site_blocks = []
+
+    # Append real sites
+    if rows:
+        site_blocks = [
+            {
+                "type": "section",
+                "text": {
+                    "type": "plain_text",
+                    "emoji": True,
+                    "text": "Here are your sites that are currently being monitored:"
+                }
+            },
+            {"type": "divider"}
+        ]
+        for row in rows:
+            user_id, channel_id, website, last_status, check_error, last_checked_at = row
+            try:
+                last_status = int(last_status)
+            except (ValueError, TypeError):
+                last_status = 10
+            friendly_status = {
+                0: "Paused",
+                1: "Not checked yet",
+                2: ":uptimerobot-up: Up",
+                8: "Seems down",
+                9: ":uptimerobot-down: Down",
+            }.get(last_status, "Unknown")
+            status_line = f"• Status: *{friendly_status}* (Code: {last_status})"
+            if check_error:
+                # The last check couldn't reach UptimeRobot, so the saved status may be out of date
+                last_checked = f", checked <!date^{int(last_checked_at)}^{{date_short_pretty}} at {{time}}|a while ago>" if last_checked_at else ""
+                status_line = f"• Status: *Unknown, not checked* (last known: {friendly_status}{last_checked})"
+            site_blocks.append({
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"""
+                        *<https://{website}|{website}>*\n
+{status_line}
+• Notification Channel: <#{channel_id}>"""
+                },
+                "accessory": {
+                    "type": "button",
+                    "style": "danger",
+                    "text": {
+                        "type": "plain_text",
+                        "emoji": True,
+                        "text": "Remove"
+                    },
+                    "value": f"remove|{website}|{channel_id}"
+                }
+            })
+            site_blocks.append({"type": "divider"})
+
+        # Add help section
+        site_blocks.extend([
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": "You can add or remove a monitor using the following commands:"
+                }
+            },
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": "`/monitor-site [url] | [api key]`  Add a new site\n `/remove-monitor-site [url] | [api key]`  Remove a site"
+                }
+            }
+        ])
+    else:
+        site_blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "No monitors were found for your current user."
+            }
+        })
+        site_blocks.append({"type": "divider"})
+        site_blocks.append({
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "You can add a monitor using the `/monitor-site [url] | [api key]` command."
+            }
+        })
+
+    return site_blocks
+
+
+def hash_blocks(blocks):
+    return hashlib.sha256(json.dumps(blocks, sort_keys=True).encode()).hexdigest()
+
+
+# Publish the user's Home view if it's different from the last one we published.
+# Returns True if views.publish was called.
+def publish_home(client, user_id, force=False):
+    rows = db.fetch_all("SELECT user_id, channel_id, website, last_status, check_error, last_checked_at FROM monitor_sites WHERE user_id = ?", (user_id,))
+    with profiling.phase("blocks"):
+        blocks = build_home_blocks(rows)
+        content_hash = hash_blocks(blocks)
+
+    if not force:
+        published = db.fetch_one("SELECT content_hash FROM home_views WHERE user_id = ?", (user_id,))
+        if published and published[0] == content_hash:
+            return False
+
+    client.views_publish(
+        user_id=user_id,
+        view={
+            "type": "home",
+            "blocks": blocks
+        }
+    )
+    db.execute(
+        "INSERT INTO home_views (user_id, content_hash, published_at) VALUES (?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET content_hash=excluded.content_hash, published_at=excluded.published_at",
+        (user_id, content_hash, time.time())
+    )
+    return True
+
+
+# Republish the Home views of the given users, skipping any whose view hasn't actually changed.
+# Sites and published hashes are loaded a batch of users at a time rather than one query per user.
+def republish_homes(client, user_ids):
+    user_ids = sorted(set(user_ids))
+    published_count = 0
+    for i in range(0, len(user_ids), home_batch_size):
+        batch = user_ids[i:i + home_batch_size]
+        placeholders = ", ".join("?" for _ in batch)
+        try:
+            rows = db.fetch_all(f"SELECT user_id, channel_id, website, last_status, check_error, last_checked_at FROM monitor_sites WHERE user_id IN ({placeholders})", batch)
+            published = dict(db.fetch_all(f"SELECT user_id, content_hash FROM home_views WHERE user_id IN ({placeholders})", batch))
+        except sqlite3.Error as e:
+            print(f"Error loading App Home views: {e}")
+            return published_count
+
+        rows_by_user = {user_id: [] for user_id in batch}
+        for row in rows:
+            rows_by_user[row[0]].append(row)
+
+        updated = []
+        for user_id in batch:
+            with profiling.phase("blocks"):
+                blocks = build_home_blocks(rows_by_user[user_id])
+                content_hash = hash_blocks(blocks)
+            if published.get(user_id) == content_hash:
+                continue
+            try:
+                client.views_publish(
+                    user_id=user_id,
+                    view={
+                        "type": "home",
+                        "blocks": blocks
+                    }
+                )
+            except SlackApiError as e:
+                if debug_mode:
+                    print(f"Error publishing App Home for {user_id}: {e}")
+                continue
+            updated.append((user_id, content_hash, time.time()))
+
+        try:
+            db.execute_many(
+                "INSERT INTO home_views (user_id, content_hash, published_at) VALUES (?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET content_hash=excluded.content_hash, published_at=excluded.published_at",
+                updated
+            )
+        except sqlite3.Error as e:
+            print(f"Error saving App Home view hashes: {e}")
+        published_count += len(updated)
+
+    if debug_mode:
+        print(f"Republished {published_count} of {len(user_ids)} App Home views.")
+    return published_count
@@ -0,0 +1,164 @@
+from dotenv import load_dotenv
+import threading
+import queue
+import time
+import os
+from metrics import Gauge, CounterFunc
+
+
+# Small background job executor for work that can't finish inside a web request, like slash commands
+# that have to wait on UptimeRobot. It has a fixed number of worker threads and a bounded queue, so a
+# burst of commands can't pile up unlimited work: once the queue is full submit() refuses the job and
+# the caller can tell the user to try again.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+job_workers = int(os.getenv("JOB_WORKERS", 4))
+job_queue_size = int(os.getenv("JOB_QUEUE_SIZE", 100))
+
+
+class JobExecutor:
+    def __init__(self, max_workers, max_queue_size, name="jobs"):
+        self.max_workers = max_workers
+        self.name = name
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.lock = threading.Lock()
+        self.started = False
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        for i in range(self.max_workers):
+            threading.Thread(target=self.work, daemon=True, name=f"{self.name}-{i}").start()
+
+    # Queue fn(*args) to run in the background. Returns False if the queue is full.
+    def submit(self, fn, *args):
+        self.start()
+        try:
+            self.queue.put_nowait((fn, args, time.monotonic()))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def work(self):
+        while True:
+            fn, args, queued_at = self.queue.get()
+            with self.lock:
+                self.running += 1
+            try:
+                if debug_mode:
+                    print(f"Running job {fn.__name__} after waiting {time.monotonic() - queued_at:.2f}s in the queue.")
+                fn(*args)
+                with self.lock:
+                    self.completed += 1
+            except Exception as e:
+                print(f"Background job {fn.__name__} failed: {e}")
+                with self.lock:
+                    self.failed += 1
+            finally:
+                with self.lock:
+                    self.running -= 1
+                self.queue.task_done()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": self.queue.qsize(),
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+
+# A single background worker for jobs that take a set of keys, like republishing the App Home of a set of
+# users. Keys submitted for the same fn and args while they're waiting are merged, so a burst of submits
+# turns into a few calls with everything that was asked for instead of overflowing a queue, and a key
+# that's asked for many times is only done once.
+class MergingJobQueue:
+    def __init__(self, name="jobs"):
+        self.name = name
+        self.pending = {}  # (fn, args) -> keys
+        self.condition = threading.Condition()
+        self.started = False
+        self.running = False
+        self.completed = 0
+        self.failed = 0
+        self.merged = 0
+
+    # Queue fn(*args, keys) to run in the background
+    def submit(self, fn, keys, *args):
+        with self.condition:
+            if not self.started:
+                self.started = True
+                threading.Thread(target=self.work, daemon=True, name=self.name).start()
+            pending = self.pending.setdefault((fn, args), set())
+            for key in keys:
+                if key in pending:
+                    self.merged += 1
+                else:
+                    pending.add(key)
+            self.condition.notify_all()
+        return True
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                (fn, args), keys = self.pending.popitem()
+                self.running = True
+            try:
+                if debug_mode:
+                    print(f"Running job {fn.__name__} for {len(keys)} keys.")
+                fn(*args, sorted(keys))
+                with self.condition:
+                    self.completed += 1
+            except Exception as e:
+                print(f"Background job {fn.__name__} failed: {e}")
+                with self.condition:
+                    self.failed += 1
+            finally:
+                with self.condition:
+                    self.running = False
+                    self.condition.notify_all()
+
+    # Wait until everything submitted so far has run
+    def join(self):
+        with self.condition:
+            while self.pending or self.running:
+                self.condition.wait()
+
+    def pending_count(self):
+        with self.condition:
+            return sum(len(keys) for keys in self.pending.values())
+
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": sum(len(keys) for keys in self.pending.values()),
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "merged": self.merged,
+            }
+
+
+command_jobs = JobExecutor(job_workers, job_queue_size, name="command-jobs")
+
+# Republishing App Home views after status changes and removed sites
+home_jobs = MergingJobQueue(name="home-views")
+
+Gauge("command_jobs_queued", "Slash commands waiting to run in the background.", lambda: command_jobs.queue.qsize())
+CounterFunc("command_jobs_rejected_total", "Slash commands turned away because the job queue was full.", lambda: command_jobs.stats()["rejected"])
+Gauge("home_views_pending", "Users waiting for their App Home view to be republished.", home_jobs.pending_count)
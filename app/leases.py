@@ -0,0 +1,105 @@
+from dotenv import load_dotenv
+from bisect import bisect
+import threading
+import hashlib
+import socket
+import sqlite3
+import atexit
+import uuid
+import time
+import os
+import db
+
+
+# Runner leases for running several schedule runners side by side.
+# Every runner registers itself in the scheduler_runners table and keeps its heartbeat up to date. The
+# runners whose heartbeat is recent enough are placed on a consistent hash ring and each runner only
+# checks the sites (by API key, so an account is still fetched in one go) and delivers the outbox
+# messages (by channel) that land on its part of the ring. When a runner stops heartbeating its share
+# moves to the others once its lease runs out, and adding a runner only moves about 1/N of the sites.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+# A runner that hasn't heartbeated for this many seconds is considered dead
+scheduler_lease_ttl = float(os.getenv("SCHEDULER_LEASE_TTL", 30))
+scheduler_heartbeat_interval = float(os.getenv("SCHEDULER_HEARTBEAT_INTERVAL", 10))
+# Points per runner on the hash ring, more points spread the sites more evenly
+ring_points_per_runner = 100
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, runner_ids):
+        points = sorted(
+            (ring_hash(f"{runner_id}#{i}"), runner_id)
+            for runner_id in runner_ids
+            for i in range(ring_points_per_runner)
+        )
+        self.hashes = [point[0] for point in points]
+        self.runner_ids = [point[1] for point in points]
+
+    def owner(self, key):
+        if not self.hashes:
+            return None
+        index = bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.runner_ids[index]
+
+
+class RunnerLease:
+    def __init__(self, runner_id=None):
+        self.runner_id = runner_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.members = (self.runner_id,)
+        self.ring = HashRing(self.members)
+        self.version = 0  # Bumped whenever the set of live runners changes
+        self.lock = threading.Lock()
+
+    def owns(self, key):
+        with self.lock:
+            return self.ring.owner(key) == self.runner_id
+
+    def heartbeat(self):
+        now = time.time()
+        with db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO scheduler_runners (runner_id, started_at, heartbeat_at) VALUES (?, ?, ?) ON CONFLICT(runner_id) DO UPDATE SET heartbeat_at=excluded.heartbeat_at",
+                (self.runner_id, now, now)
+            )
+            # Forget runners that have been gone for a while
+            conn.execute("DELETE FROM scheduler_runners WHERE heartbeat_at < ?", (now - scheduler_lease_ttl * 10,))
+            rows = conn.execute("SELECT runner_id FROM scheduler_runners WHERE heartbeat_at >= ?", (now - scheduler_lease_ttl,)).fetchall()
+
+        members = tuple(sorted({row[0] for row in rows} | {self.runner_id}))
+        if members != self.members:
+            with self.lock:
+                self.members = members
+                self.ring = HashRing(members)
+                self.version += 1
+            print(f"Schedule runners changed, {len(members)} now running: {', '.join(members)}")
+
+    def release(self):
+        try:
+            db.execute("DELETE FROM scheduler_runners WHERE runner_id = ?", (self.runner_id,))
+        except sqlite3.Error as e:
+            print(f"Error releasing the scheduler lease: {e}")
+
+    def run_heartbeat(self):
+        while True:
+            time.sleep(scheduler_heartbeat_interval)
+            try:
+                self.heartbeat()
+            except sqlite3.Error as e:
+                print(f"Error updating the scheduler lease: {e}")
+
+    # Register this runner and keep its lease alive in the background
+    def start(self):
+        self.heartbeat()
+        threading.Thread(target=self.run_heartbeat, daemon=True, name="scheduler-lease").start()
+        atexit.register(self.release)
+        if debug_mode:
+            print(f"Schedule runner {self.runner_id} started.")
+        return self
@@ -0,0 +1,197 @@
+from dotenv import load_dotenv
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+import threading
+import time
+import os
+import profiling
+
+
+# Minimal Prometheus metrics: counters, histograms and gauges that are read when scraped, rendered in the
+# Prometheus text format. The web app serves them at /metrics and the schedule runner can serve them on
+# SCHEDULER_METRICS_PORT. Each process has its own numbers, so scrape both.
+
+load_dotenv()
+
+# Port for the schedule runner's metrics server. Not started if empty.
+scheduler_metrics_port = os.getenv("SCHEDULER_METRICS_PORT")
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+registry = []
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=default_buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self.values[label_values] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    # Time the block and record it
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+
+# A gauge whose value is read from read() at scrape time
+class Gauge:
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        registry.append(self)
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}", f"{self.name} {value}"]
+
+
+# A counter kept by some other object (eg. the status cache's hit count), read from read() at scrape time.
+# The value must only go up, apart from starting again at 0 when the process restarts.
+class CounterFunc(Gauge):
+    metric_type = "counter"
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+uptimerobot_request_seconds = Histogram("uptimerobot_request_duration_seconds", "UptimeRobot API request latency, including retries.", ("operation",))
+uptimerobot_errors = Counter("uptimerobot_errors_total", "UptimeRobot API calls that failed, by error type.", ("type",))
+uptimerobot_retries = Counter("uptimerobot_retries_total", "UptimeRobot API requests retried by the HTTP retry policy, by reason.", ("reason",))
+slack_request_seconds = Histogram("slack_request_duration_seconds", "Slack Web API call latency.", ("method",))
+slack_errors = Counter("slack_errors_total", "Slack Web API calls that failed, by method and error.", ("method", "error"))
+db_query_seconds = Histogram("db_query_duration_seconds", "SQLite query latency.", ("operation",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+check_cycle_seconds = Histogram("check_cycle_duration_seconds", "Time taken to check a batch of sites, from fetching statuses to queueing notifications.")
+check_cycle_sites = Counter("check_cycle_sites_total", "Sites checked by the scheduled checks.")
+check_stage_seconds = Histogram("check_stage_duration_seconds", "Time each stage of a check cycle spent working, not counting waiting on the other stages.", ("stage",))
+check_stage_wait_seconds = Counter("check_stage_wait_seconds_total", "Time stages of the check cycle spent waiting for input or for room in the next stage's queue.", ("stage", "on"))
+check_stage_errors = Counter("check_stage_errors_total", "Check cycle stages that failed.", ("stage",))
+check_account_errors = Counter("check_account_errors_total", "Accounts a check cycle stage failed on, which are left unchecked.", ("stage",))
+check_cycle_skipped_sites = Counter("check_cycle_skipped_sites_total", "Sites left unchecked because their account couldn't be fetched (error, open circuit breaker or cycle deadline).")
+uptimerobot_quota_rejections = Counter("uptimerobot_quota_rejections_total", "UptimeRobot requests not made because the API key's request budget was used up, by priority.", ("priority",))
+uptimerobot_quota_wait_seconds = Counter("uptimerobot_quota_wait_seconds_total", "Time commands waited for their API key's request budget.")
+uptimerobot_breaker_rejections = Counter("uptimerobot_breaker_rejections_total", "UptimeRobot calls turned away by an open circuit breaker, by breaker.", ("breaker",))
+status_transitions = Counter("status_transitions_total", "Site status changes saved by the scheduled checks.", ("from_status", "to_status"))
+scheduler_overruns = Counter("scheduler_overruns_total", "Check batches that ran past the next tick of some of their sites.")
+scheduler_missed_ticks = Counter("scheduler_missed_ticks_total", "Site checks skipped because an earlier check overran.")
+
+
+# WebClient that records the latency and errors of every Slack Web API call
+class InstrumentedWebClient(WebClient):
+    def api_call(self, api_method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with profiling.phase("slack"):
+                return super().api_call(api_method, *args, **kwargs)
+        except SlackApiError as e:
+            error = "ratelimited" if e.response.status_code == 429 else e.response.get("error", "unknown")
+            slack_errors.inc(api_method, error)
+            raise
+        except Exception as e:
+            slack_errors.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            slack_request_seconds.observe(time.perf_counter() - start, api_method)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics from the schedule runner, which has no web server of its own
+def start_metrics_server(port=None):
+    port = port or scheduler_metrics_port
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("127.0.0.1", int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    print(f"Serving scheduler metrics on port {port}.")
+    return server
@@ -0,0 +1,226 @@
+import time
+import db
+
+
+# Versioned schema migrations.
+# Every migration runs once, in its own transaction, and is recorded in the schema_migrations table. Both
+# the web app and the schedule runner call migrate() at startup. If they start at the same time the one
+# that gets to a migration second waits for the first one's transaction and then skips it.
+# Add new migrations to the end of the list, never change one that has been released.
+
+
+def add_column(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# Everything up to the first versioned migration. Databases from before migrations existed already have
+# some of this, so every step checks first.
+def baseline(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS monitor_sites (
+            id INTEGER PRIMARY KEY,
+            time_added DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_id text,
+            channel_id TEXT,
+            website TEXT,
+            api_key TEXT,
+            last_status TEXT,
+            check_interval INTEGER,
+            monitor_id INTEGER
+        )
+    """)
+    add_column(conn, "monitor_sites", "check_interval", "INTEGER")
+    add_column(conn, "monitor_sites", "monitor_id", "INTEGER")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS slack_outbox (
+            id INTEGER PRIMARY KEY,
+            channel_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            next_attempt_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            sent_at REAL,
+            failed_at REAL,
+            claimed_at REAL,
+            blocks TEXT
+        )
+    """)
+    add_column(conn, "slack_outbox", "claimed_at", "REAL")
+    add_column(conn, "slack_outbox", "blocks", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS slack_outbox_pending ON slack_outbox (id) WHERE sent_at IS NULL AND failed_at IS NULL")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS home_views (
+            user_id TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            published_at REAL NOT NULL
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_runners (
+            runner_id TEXT PRIMARY KEY,
+            started_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_accounts (
+            id INTEGER PRIMARY KEY,
+            api_key TEXT NOT NULL UNIQUE,
+            secret_hash TEXT NOT NULL,
+            push_enabled INTEGER NOT NULL DEFAULT 1,
+            created_at REAL NOT NULL
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS status_history (
+            id INTEGER PRIMARY KEY,
+            website TEXT NOT NULL,
+            from_status INTEGER,
+            to_status INTEGER NOT NULL,
+            changed_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS status_history_changed_at ON status_history (changed_at)")
+    # period is the length of the period in seconds (hour or day), period_start is a unix timestamp
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS status_rollups (
+            website TEXT NOT NULL,
+            period INTEGER NOT NULL,
+            period_start INTEGER NOT NULL,
+            up_seconds REAL NOT NULL DEFAULT 0,
+            down_seconds REAL NOT NULL DEFAULT 0,
+            outages INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (website, period, period_start)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS status_rollups_period_start ON status_rollups (period, period_start)")
+    # The status of every website at rolled_until, where the next rollup carries on from
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS status_rollup_state (
+            website TEXT PRIMARY KEY,
+            status INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS status_rollup_meta (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS digest_pending (
+            id INTEGER PRIMARY KEY,
+            channel_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            website TEXT NOT NULL,
+            from_status TEXT,
+            to_status INTEGER NOT NULL,
+            held_at REAL NOT NULL,
+            UNIQUE (channel_id, user_id, website)
+        )
+    """)
+
+
+# A site can only be added once per user and channel, which also covers the user_id lookups of the App Home
+# and the remove paths. channel_id is for /check-sites-in-db's channel filter and (api_key, website) for the
+# webhook and for looking up stored monitor ids.
+def monitor_sites_indexes(conn):
+    # Keep the oldest row of any duplicates so the unique index can be created
+    conn.execute("DELETE FROM monitor_sites WHERE id NOT IN (SELECT MIN(id) FROM monitor_sites GROUP BY user_id, channel_id, website)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS monitor_sites_user_channel_website ON monitor_sites (user_id, channel_id, website)")
+    conn.execute("CREATE INDEX IF NOT EXISTS monitor_sites_channel ON monitor_sites (channel_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS monitor_sites_api_key_website ON monitor_sites (api_key, website)")
+
+
+# Profiling asked for with /admin/profile, picked up by the web workers and schedule runners
+def profile_requests(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS profile_requests (
+            kind TEXT PRIMARY KEY,
+            remaining INTEGER NOT NULL
+        )
+    """)
+
+
+# The outbox delivers the oldest pending message of each channel
+def slack_outbox_pending_channel(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS slack_outbox_pending_channel ON slack_outbox (channel_id, id) WHERE sent_at IS NULL AND failed_at IS NULL")
+
+
+# When the schedule runner last got each site's status from UptimeRobot, and its monitor's url, so the web
+# app can answer commands from what the runner saved
+def monitor_sites_last_checked(conn):
+    add_column(conn, "monitor_sites", "last_checked_at", "REAL")
+    add_column(conn, "monitor_sites", "monitor_url", "TEXT")
+
+
+# Recent status changes per channel, for deciding when a channel goes into digest mode
+def digest_recent_changes(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS digest_recent_changes (
+            channel_id TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS digest_recent_changes_changed_at ON digest_recent_changes (changed_at)")
+
+
+# Why a site couldn't be checked last time, for showing it as not checked instead of its last status. Only
+# the sites with an error are indexed, to find the ones that can be cleared.
+def monitor_sites_check_error(conn):
+    add_column(conn, "monitor_sites", "check_error", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS monitor_sites_check_error ON monitor_sites (api_key) WHERE check_error IS NOT NULL")
+
+
+# Request budgets for the UptimeRobot API keys, shared by the web app and the schedule runners (see quotas.py)
+def uptime_request_budgets(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS uptime_request_budgets (
+            api_key TEXT PRIMARY KEY,
+            capacity REAL NOT NULL,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            blocked_until REAL NOT NULL DEFAULT 0
+        )
+    """)
+
+
+migrations = [
+    (1, "baseline", baseline),
+    (2, "monitor_sites_indexes", monitor_sites_indexes),
+    (3, "profile_requests", profile_requests),
+    (4, "slack_outbox_pending_channel", slack_outbox_pending_channel),
+    (5, "monitor_sites_last_checked", monitor_sites_last_checked),
+    (6, "digest_recent_changes", digest_recent_changes),
+    (7, "monitor_sites_check_error", monitor_sites_check_error),
+    (8, "uptime_request_budgets", uptime_request_budgets),
+]
+
+
+def migrate():
+    with db.transaction() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at REAL NOT NULL)")
+        applied = {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+
+    for version, name, migration in migrations:
+        if version in applied:
+            continue
+        with db.transaction() as conn:
+            # Recording the migration first takes the write lock, so if another process is running it we
+            # wait for it here and then find it already recorded
+            recorded = conn.execute(
+                "INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, time.time())
+            ).rowcount
+            if recorded:
+                migration(conn)
+                print(f"Applied database migration {version} ({name}).")
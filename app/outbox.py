@@ -0,0 +1,185 @@
+from dotenv import load_dotenv
+from slack_sdk.errors import SlackApiError
+from itertools import islice
+import threading
+import sqlite3
+import json
+import time
+import os
+import db
+from metrics import Gauge, Histogram
+
+
+# Persistent outbox for Slack notifications.
+# The scheduled check only inserts messages into the slack_outbox table (in the same transaction as the
+# status changes that caused them) and a separate delivery worker thread posts them. A slow Slack call,
+# a 429 or any other error only delays delivery, it never stops or slows down the status checks.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+# chat.postMessage is limited to roughly one message per second per channel
+outbox_channel_interval = float(os.getenv("OUTBOX_CHANNEL_INTERVAL", 1.0))
+outbox_max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10))
+outbox_batch_size = int(os.getenv("OUTBOX_BATCH_SIZE", 200))
+outbox_poll_interval = float(os.getenv("OUTBOX_POLL_INTERVAL", 0.5))
+# Delivered messages are kept this many days for the latency stats before being deleted
+outbox_retention_days = int(os.getenv("OUTBOX_RETENTION_DAYS", 7))
+
+
+# Queue messages for delivery. messages is a list of (channel_id, text) or (channel_id, text, blocks) tuples,
+# where text is the notification fallback for messages with blocks.
+# Pass conn to queue them as part of a transaction that's already open.
+def enqueue_many(messages, conn=None):
+    if not messages:
+        return
+    now = time.time()
+    rows = [(message[0], message[1], json.dumps(message[2]) if len(message) > 2 else None, now, now) for message in messages]
+    query = "INSERT INTO slack_outbox (channel_id, text, blocks, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)"
+    if conn is not None:
+        conn.executemany(query, rows)
+    else:
+        db.execute_many(query, rows)
+
+
+def enqueue(channel_id, text, conn=None):
+    enqueue_many([(channel_id, text)], conn)
+
+
+# Queue depth and delivery latency, read from the table so both processes can report them
+def stats():
+    now = time.time()
+    pending, oldest = db.fetch_one("SELECT COUNT(*), MIN(created_at) FROM slack_outbox WHERE sent_at IS NULL AND failed_at IS NULL")
+    failed = db.fetch_one("SELECT COUNT(*) FROM slack_outbox WHERE failed_at IS NOT NULL")[0]
+    sent, avg_latency, max_latency = db.fetch_one(
+        "SELECT COUNT(*), AVG(sent_at - created_at), MAX(sent_at - created_at) FROM slack_outbox WHERE sent_at >= ?",
+        (now - 15 * 60,)
+    )
+    return {
+        "pending": pending,
+        "oldest_pending_age_seconds": round(now - oldest, 3) if oldest else 0,
+        "failed": failed,
+        "sent_last_15_minutes": sent,
+        "avg_delivery_latency_seconds": round(avg_latency, 3) if avg_latency is not None else None,
+        "max_delivery_latency_seconds": round(max_latency, 3) if max_latency is not None else None,
+    }
+
+
+def pending_count():
+    return db.fetch_one("SELECT COUNT(*) FROM slack_outbox WHERE sent_at IS NULL AND failed_at IS NULL")[0]
+
+
+def oldest_pending_age():
+    oldest = db.fetch_one("SELECT MIN(created_at) FROM slack_outbox WHERE sent_at IS NULL AND failed_at IS NULL")[0]
+    return round(time.time() - oldest, 3) if oldest else 0
+
+
+outbox_delivery_seconds = Histogram("slack_outbox_delivery_latency_seconds", "Time from a Slack message being queued to it being delivered.")
+Gauge("slack_outbox_pending", "Slack messages waiting to be delivered.", pending_count)
+Gauge("slack_outbox_oldest_pending_age_seconds", "Age of the oldest Slack message waiting to be delivered.", oldest_pending_age)
+
+
+# lease is an optional leases.RunnerLease. With one, only messages for the channels this runner owns
+# are delivered, which also keeps each channel's rate limiting in a single process.
+class DeliveryWorker:
+    def __init__(self, client, lease=None):
+        self.client = client
+        self.lease = lease
+        self.channel_next_allowed = {}
+        self.paused_until = 0
+        self.last_cleanup = 0
+
+    # Send whatever is due. Messages for a channel are always delivered in the order they were queued, so
+    # only the oldest pending message of each channel is looked at. A message that has to wait holds back
+    # the later messages for its channel but a backlog in one channel never holds up the others.
+    # Channels owned by other runners and messages that have to wait are left out before taking at most
+    # outbox_batch_size messages, so they can't crowd out the ones this runner could send.
+    # Returns how many messages were sent.
+    def deliver_due(self):
+        now = time.time()
+        rows = list(islice((
+            row for row in db.iter_rows(
+                "SELECT id, channel_id, text, blocks, attempts, next_attempt_at, created_at FROM slack_outbox WHERE id IN ("
+                "SELECT MIN(id) FROM slack_outbox WHERE sent_at IS NULL AND failed_at IS NULL GROUP BY channel_id"
+                ") ORDER BY id"
+            )
+            if (not self.lease or self.lease.owns(row[1])) and row[5] <= now and self.channel_next_allowed.get(row[1], 0) <= now
+        ), outbox_batch_size))
+        sent = 0
+        for message_id, channel_id, text, blocks, attempts, next_attempt_at, created_at in rows:
+            now = time.time()
+            if now < self.paused_until:
+                return sent
+
+            # Claim the message first so that if two runners briefly disagree on who owns the channel
+            # only one of them sends it. Claims from a runner that died mid send expire after a minute.
+            claimed = db.execute(
+                "UPDATE slack_outbox SET claimed_at=? WHERE id=? AND sent_at IS NULL AND (claimed_at IS NULL OR claimed_at < ?)",
+                (now, message_id, now - 60)
+            )
+            if not claimed:
+                continue
+
+            self.channel_next_allowed[channel_id] = now + outbox_channel_interval
+            try:
+                self.client.chat_postMessage(
+                    channel=channel_id,
+                    text=text,
+                    blocks=json.loads(blocks) if blocks else None,
+                    unfurl_links=False,
+                    unfurl_media=False
+                )
+            except SlackApiError as e:
+                if e.response.status_code == 429:
+                    retry_after = int(e.response.headers.get("Retry-After", 1))
+                    self.paused_until = time.time() + retry_after
+                    self.retry_later(message_id, attempts, retry_after, "ratelimited", count_attempt=False)
+                    if debug_mode:
+                        print(f"Slack rate limited the outbox, pausing delivery for {retry_after}s.")
+                    return sent
+                self.retry_later(message_id, attempts, min(2 ** attempts, 300), e.response.get("error", str(e)))
+                continue
+            except Exception as e:
+                self.retry_later(message_id, attempts, min(2 ** attempts, 300), str(e))
+                continue
+
+            sent_at = time.time()
+            db.execute("UPDATE slack_outbox SET sent_at=?, attempts=? WHERE id=?", (sent_at, attempts + 1, message_id))
+            outbox_delivery_seconds.observe(sent_at - created_at)
+            sent += 1
+        return sent
+
+    def retry_later(self, message_id, attempts, delay, error, count_attempt=True):
+        if count_attempt:
+            attempts += 1
+        if attempts >= outbox_max_attempts:
+            print(f"Giving up on Slack message {message_id} after {attempts} attempts: {error}")
+            db.execute("UPDATE slack_outbox SET attempts=?, last_error=?, failed_at=? WHERE id=?", (attempts, error, time.time(), message_id))
+        else:
+            db.execute("UPDATE slack_outbox SET attempts=?, last_error=?, next_attempt_at=?, claimed_at=NULL WHERE id=?", (attempts, error, time.time() + delay, message_id))
+
+    def cleanup(self):
+        now = time.time()
+        if now - self.last_cleanup < 3600:
+            return
+        self.last_cleanup = now
+        db.execute("DELETE FROM slack_outbox WHERE sent_at < ?", (now - outbox_retention_days * 86400,))
+
+    def run(self):
+        while True:
+            sent = 0
+            try:
+                sent = self.deliver_due()
+                self.cleanup()
+            except sqlite3.Error as e:
+                print(f"Error reading the Slack outbox: {e}")
+            # Anything sent may have a next message in its channel that's already due
+            if not sent:
+                time.sleep(outbox_poll_interval)
+
+
+def start_delivery_worker(client, lease=None):
+    worker = DeliveryWorker(client, lease)
+    threading.Thread(target=worker.run, daemon=True, name="slack-outbox").start()
+    return worker
@@ -0,0 +1,184 @@
+import threading
+import queue
+import time
+import profiling
+from metrics import check_stage_seconds, check_stage_wait_seconds, check_stage_errors
+
+
+# A chain of stages connected by bounded queues, used to stream the check cycle.
+# Each stage is a generator function that takes an iterable of items and yields items for the next stage,
+# and runs in its own thread. The threads are started on the first run and kept for the next ones, one run
+# at a time, so a run doesn't start threads or open db connections of its own. The queues between the stages
+# are bounded, so a stage that gets ahead waits for the next one instead of buffering everything
+# (backpressure) and memory use doesn't grow with the number of items. Each stage's time is split into working, waiting for input and waiting for room in the next
+# queue, which shows where a slow cycle spends its time.
+# If a stage fails it's logged and its remaining input is thrown away, so the stages before it can finish,
+# and the stages after it finish with what they already got.
+
+_done = object()
+
+
+class Stopped(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.reset()
+
+    # Clear the numbers from the last run
+    def reset(self):
+        self.items = 0
+        self.seconds = 0.0
+        self.input_wait = 0.0
+        self.output_wait = 0.0
+        self.error = None
+
+    # Time spent working, not waiting on the other stages
+    @property
+    def busy(self):
+        return max(0.0, self.seconds - self.input_wait - self.output_wait)
+
+
+class Pipeline:
+    def __init__(self, name, stages, queue_size):
+        self.name = name
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.starts = [queue.Queue() for _ in stages]  # Each run's source (for the first stage) or None
+        self.finished = threading.Semaphore(0)  # Released by each stage as it finishes a run
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = None
+        self.context = None
+
+    def start_threads(self):
+        self.threads = []
+        for i, stage in enumerate(self.stages):
+            thread = threading.Thread(target=self.stage_loop, args=(i, stage), daemon=True, name=f"{self.name}-{stage.name}")
+            thread.start()
+            self.threads.append(thread)
+
+    def stage_loop(self, i, stage):
+        while True:
+            source = self.starts[i].get()
+            items = source if i == 0 else self.receive(self.queues[i - 1], stage)
+            try:
+                self.run_stage(stage, items, self.queues[i], i > 0)
+            finally:
+                self.finished.release()
+
+    # Run source through the stages, yielding what the last one yields. context is kept in self.context for
+    # the stages to read during the run (eg. the check cycle's deadline).
+    def run(self, source, context=None):
+        with self.lock:
+            if self.threads is None:
+                self.start_threads()
+            for stage in self.stages:
+                stage.reset()
+            self.context = context
+            self.stopped.clear()
+            for i, start in enumerate(self.starts):
+                start.put(source if i == 0 else None)
+
+            try:
+                while True:
+                    item = self.queues[-1].get()
+                    if item is _done:
+                        break
+                    yield item
+            finally:
+                # Stop any stage that's still going and wait for all of them to be ready for the next run
+                self.stopped.set()
+                for _ in self.stages:
+                    while not self.finished.acquire(timeout=0.1):
+                        for item_queue in self.queues:
+                            self.drain(item_queue)
+                for item_queue in self.queues:
+                    self.drain(item_queue)
+                self.context = None
+                for stage in self.stages:
+                    check_stage_seconds.observe(stage.busy, stage.name)
+                    check_stage_wait_seconds.inc(stage.name, "input", amount=stage.input_wait)
+                    check_stage_wait_seconds.inc(stage.name, "output", amount=stage.output_wait)
+
+    def run_stage(self, stage, items, output, drain_input):
+        start = time.perf_counter()
+        try:
+            with profiling.thread_profile():
+                for item in stage.fn(items):
+                    self.put(output, item, stage)
+        except Stopped:
+            pass
+        except Exception as e:
+            stage.error = e
+            check_stage_errors.inc(stage.name)
+            print(f"{self.name} stage {stage.name} failed: {e}")
+            if drain_input:
+                try:
+                    for _ in items:
+                        pass
+                except Stopped:
+                    pass
+        finally:
+            stage.seconds = time.perf_counter() - start
+            try:
+                self.put(output, _done, stage)
+            except Stopped:
+                pass
+
+    def receive(self, input_queue, stage):
+        while True:
+            start = time.perf_counter()
+            try:
+                item = self.get(input_queue)
+            finally:
+                stage.input_wait += time.perf_counter() - start
+            if item is _done:
+                return
+            stage.items += 1
+            yield item
+
+    # Queue get and put that give up with Stopped once the pipeline has been stopped
+    def get(self, input_queue):
+        while True:
+            if self.stopped.is_set():
+                raise Stopped()
+            try:
+                return input_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def put(self, output, item, stage):
+        start = time.perf_counter()
+        try:
+            while True:
+                if self.stopped.is_set():
+                    raise Stopped()
+                try:
+                    output.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+        finally:
+            stage.output_wait += time.perf_counter() - start
+
+    # Empty a queue so a stage blocked on putting to it can see that the pipeline stopped
+    def drain(self, item_queue):
+        while True:
+            try:
+                item_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    # "fetch 1.20s, diff 0.05s (waited 0.40s for the next stage)..." for the logs
+    def report(self):
+        parts = []
+        for stage in self.stages:
+            part = f"{stage.name} {stage.busy:.2f}s"
+            if stage.output_wait >= 0.01:
+                part += f" (waited {stage.output_wait:.2f}s for the next stage)"
+            parts.append(part)
+        return ", ".join(parts)
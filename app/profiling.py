@@ -0,0 +1,230 @@
+from dotenv import load_dotenv
+from contextlib import contextmanager, nullcontext
+import threading
+import cProfile
+import pstats
+import hmac
+import time
+import io
+import os
+import re
+
+
+# On-demand profiling of check cycles and web requests.
+# Profiling is off until it's asked for, either at startup with PROFILE_CHECK_CYCLES / PROFILE_REQUESTS or
+# while running with POST /admin/profile (which needs PROFILE_TOKEN to be set). Either one profiles the next N
+# check cycles or requests, one at a time. Each profiled one writes a cProfile dump (.prof, for pstats or
+# snakeviz) and a text report to PROFILE_DIR, with how long was spent in the db, UptimeRobot, Slack and
+# building blocks.
+# When nothing is being profiled the hooks cost a check of a global and, for requests, a clock read, so
+# they can stay deployed.
+
+load_dotenv()
+
+profile_dir = os.getenv("PROFILE_DIR", "profiles")
+profile_token = os.getenv("PROFILE_TOKEN")
+# How often each process checks the db for profiling asked for with /admin/profile
+profile_poll_interval = float(os.getenv("PROFILE_POLL_INTERVAL", 10))
+
+# Profiling asked for at startup, used up before anything from the db
+remaining = {
+    "cycle": int(os.getenv("PROFILE_CHECK_CYCLES", 0)),
+    "request": int(os.getenv("PROFILE_REQUESTS", 0)),
+}
+next_poll = {"cycle": 0.0, "request": 0.0}
+phases = ("db", "uptimerobot", "slack", "blocks")
+
+_session = None
+_lock = threading.Lock()
+_local = threading.local()
+_no_phase = nullcontext()
+
+
+class Session:
+    def __init__(self, kind, label):
+        self.kind = kind
+        self.label = label
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.threads = {threading.get_ident()}
+        self.profiler = cProfile.Profile()
+        self.profiles = [self.profiler]
+        self.phase_seconds = dict.fromkeys(phases, 0.0)
+        self.phase_calls = dict.fromkeys(phases, 0)
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+            self.phase_calls[name] = self.phase_calls.get(name, 0) + 1
+
+
+# Ask every process to profile its next cycles check cycles and/or requests requests. A kind that's left as
+# None keeps whatever was asked for it before.
+def arm(cycles=None, requests=None):
+    import db  # Not at the top, db (and metrics) use the phases from here
+    with db.transaction() as conn:
+        for kind, count in (("cycle", cycles), ("request", requests)):
+            if count is None:
+                continue
+            conn.execute(
+                "INSERT INTO profile_requests (kind, remaining) VALUES (?, ?) ON CONFLICT(kind) DO UPDATE SET remaining = excluded.remaining",
+                (kind, count)
+            )
+
+
+def authorized(authorization):
+    if not profile_token or not authorization:
+        return False
+    return hmac.compare_digest(authorization, f"Bearer {profile_token}")
+
+
+# Whether the next cycle or request should be profiled. The db is only checked if PROFILE_TOKEN is set,
+# without it nothing can ask for profiling there.
+def take(kind):
+    if remaining[kind] <= 0 and (not profile_token or time.monotonic() < next_poll[kind]):
+        return False
+    with _lock:
+        if remaining[kind] <= 0:
+            now = time.monotonic()
+            if now < next_poll[kind]:
+                return False
+            next_poll[kind] = now + profile_poll_interval
+            try:
+                remaining[kind] += claim(kind)
+            except Exception as e:
+                print(f"Error checking for profiling requests: {e}")
+            if remaining[kind] <= 0:
+                return False
+        remaining[kind] -= 1
+        return True
+
+
+# Take everything asked for with /admin/profile. With several processes the first one to look gets it.
+def claim(kind):
+    import db
+    with db.transaction() as conn:
+        row = conn.execute("SELECT remaining FROM profile_requests WHERE kind = ?", (kind,)).fetchone()
+        if not row or not row[0]:
+            return 0
+        conn.execute("UPDATE profile_requests SET remaining = 0 WHERE kind = ?", (kind,))
+        return row[0]
+
+
+# Start profiling a cycle or request in this thread if it's been asked for. Returns the session to pass to
+# finish(), or None.
+def start(kind, label):
+    global _session
+    if _session is not None or not take(kind):
+        return None
+    with _lock:
+        if _session is not None:
+            remaining[kind] += 1
+            return None
+        session = _session = Session(kind, label)
+    try:
+        session.profiler.enable()
+    except ValueError:
+        session.profiles = []  # Something else is already profiling (Python 3.12+ allows only one profiler)
+    return session
+
+
+def finish(session):
+    global _session
+    if session is None:
+        return
+    session.profiler.disable()
+    wall = time.perf_counter() - session.start
+    with _lock:
+        _session = None
+    try:
+        write(session, wall)
+    except Exception as e:
+        print(f"Error writing profile: {e}")
+
+
+# Add this thread to the session being recorded, if any, so its phases are counted. Used as the initializer
+# of thread pools that work for a profiled cycle.
+def join_thread():
+    session = _session
+    if session is not None:
+        with session.lock:
+            session.threads.add(threading.get_ident())
+
+
+# Profile the block in this thread as part of the session being recorded, if any
+@contextmanager
+def thread_profile():
+    session = _session
+    if session is None:
+        yield
+        return
+    join_thread()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ only allows one profiler at a time, and the session's already sees every thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with session.lock:
+            session.profiles.append(profiler)
+
+
+# Time the block as a phase (db, uptimerobot, slack or blocks) of the session being recorded. Nested
+# phases of the same kind are only counted once.
+def phase(name):
+    session = _session
+    if session is None:
+        return _no_phase
+    return timed_phase(session, name)
+
+
+@contextmanager
+def timed_phase(session, name):
+    active = getattr(_local, "phases", None)
+    if active is None:
+        active = _local.phases = set()
+    if name in active or threading.get_ident() not in session.threads:
+        yield
+        return
+    active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.discard(name)
+        session.record(name, time.perf_counter() - start)
+
+
+def write(session, wall):
+    os.makedirs(profile_dir, exist_ok=True)
+    label = re.sub(r"[^a-zA-Z0-9]+", "-", session.label).strip("-") or "index"
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(session.started_at)) + f"-{int(session.started_at * 1000) % 1000:03d}"
+    path = os.path.join(profile_dir, f"{session.kind}-{stamp}-{label}")
+
+    stats = None
+    for profiler in session.profiles:
+        try:
+            stats = pstats.Stats(profiler) if stats is None else stats.add(profiler)
+        except TypeError:
+            pass  # Nothing was recorded in that thread
+
+    report = io.StringIO()
+    report.write(f"{session.kind} {session.label} at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(session.started_at))}\n")
+    report.write(f"Wall time: {wall:.3f}s\n\n")
+    report.write(f"{'phase':<12} {'seconds':>9} {'calls':>7}\n")
+    for name in session.phase_seconds:
+        report.write(f"{name:<12} {session.phase_seconds[name]:>9.3f} {session.phase_calls[name]:>7}\n")
+    report.write("Phases are added up over every thread that took part, so together they can be longer than the wall time.\n\n")
+    if stats is not None:
+        stats.dump_stats(path + ".prof")
+        stats.stream = report
+        stats.sort_stats("cumulative").print_stats(40)
+    with open(path + ".txt", "w") as f:
+        f.write(report.getvalue())
+    print(f"Wrote profile of {session.kind} {session.label} ({wall:.2f}s) to {path}.txt")
@@ -0,0 +1,185 @@
+from dotenv import load_dotenv
+import threading
+import sqlite3
+import time
+import os
+import db
+from metrics import Gauge, uptimerobot_quota_rejections, uptimerobot_quota_wait_seconds
+
+
+# Request budgets for UptimeRobot API keys.
+# UptimeRobot limits how many requests an API key can make per minute, depending on the account's plan. Every
+# key gets a token bucket holding a minute's worth of requests, and every getMonitors request takes a token.
+# Interactive requests (slash commands) can use the whole bucket and wait a little for a token, background
+# polling only uses what's above a reserve and never waits, so commands still work while the scheduler is
+# busy. When polling runs out of budget for a key the scheduler checks that key's sites less often (up to
+# UPTIME_QUOTA_MAX_STRETCH times the normal interval) until the budget recovers.
+# A key's limit comes from its plan tier until UptimeRobot's X-RateLimit-Limit header says otherwise, and a
+# 429 response empties the bucket until its Retry-After.
+# The buckets are kept in the db, so the web app (where commands run) and the schedule runners (where the
+# polling happens) take from the same budget for a key and the reserve really is left for commands.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+
+# "free=10,pro=300" -> {"free": "10", "pro": "300"}
+def parse_pairs(value):
+    pairs = {}
+    for part in (value or "").split(","):
+        name, _, setting = part.partition("=")
+        if name.strip() and setting.strip():
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+# Requests per minute for each plan tier, the tier of keys that aren't listed and the keys on other tiers
+rate_limit_tiers = {tier: float(limit) for tier, limit in parse_pairs(os.getenv("UPTIME_RATE_LIMITS", "free=10,pro=300")).items()}
+default_tier = os.getenv("UPTIME_RATE_LIMIT_TIER", "free")
+key_tiers = parse_pairs(os.getenv("UPTIME_KEY_TIERS"))
+# Share of each bucket that only interactive requests can use
+interactive_reserve = float(os.getenv("UPTIME_INTERACTIVE_RESERVE", 0.2))
+# Seconds an interactive request waits for a token before giving up
+quota_wait = float(os.getenv("UPTIME_QUOTA_WAIT", 10))
+quota_max_stretch = float(os.getenv("UPTIME_QUOTA_MAX_STRETCH", 8))
+
+
+# Each key's bucket is a row in the uptime_request_budgets table, so the web app's commands and the schedule
+# runner's polling share it. tokens is how many were left at updated_at (a unix time), and it refills at a
+# capacity's worth per minute. The SQL below refills it up to now.
+def refilled(now):
+    return "MIN(capacity, tokens + MAX(0, {now} - updated_at) * capacity / 60.0)".format(now=float(now))
+
+
+_known_keys = set()
+
+
+def ensure_bucket(api_key, conn):
+    if api_key in _known_keys:
+        return
+    tier = key_tiers.get(api_key, default_tier)
+    capacity = max(1.0, rate_limit_tiers.get(tier, 10))
+    conn.execute(
+        "INSERT OR IGNORE INTO uptime_request_budgets (api_key, capacity, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?, 0)",
+        (api_key, capacity, capacity, time.time())
+    )
+    _known_keys.add(api_key)
+
+
+# Take count tokens, leaving at least floor_share of the bucket's capacity in it. Returns (0, tokens left) if
+# they were taken, otherwise (seconds until there would be enough, tokens left). The UPDATE refills and takes
+# in one statement, so two processes can't take the same token.
+def take(api_key, floor_share=0.0, count=1):
+    now = time.time()
+    with db.transaction() as conn:
+        ensure_bucket(api_key, conn)
+        taken = conn.execute(
+            f"UPDATE uptime_request_budgets SET tokens = {refilled(now)} - ?, updated_at = ? WHERE api_key = ? AND blocked_until <= ? AND {refilled(now)} >= capacity * ? + ?",
+            (count, now, api_key, now, floor_share, count)
+        ).rowcount
+        row = conn.execute(
+            f"SELECT {refilled(now)}, capacity, blocked_until FROM uptime_request_budgets WHERE api_key = ?",
+            (api_key,)
+        ).fetchone()
+    if row is None:
+        # The row was rolled back along with an earlier transaction, add it again next time
+        _known_keys.discard(api_key)
+        raise sqlite3.OperationalError("no request budget saved for the API key")
+    tokens, capacity, blocked_until = row
+    if taken:
+        return 0, tokens, capacity
+    if now < blocked_until:
+        return blocked_until - now, tokens, capacity
+    return (capacity * floor_share + count - tokens) / (capacity / 60), tokens, capacity
+
+
+# How many times its normal interval the scheduler polls each key's sites. Only the process polling a key
+# uses it, so it's kept in memory.
+_stretch = {}
+_stretch_lock = threading.Lock()
+
+
+# Polling ran out of budget: back off. It got a token with plenty to spare: come back towards the normal
+# interval.
+def update_stretch(api_key, taken, tokens, capacity):
+    with _stretch_lock:
+        current = _stretch.get(api_key, 1.0)
+        if not taken:
+            _stretch[api_key] = min(quota_max_stretch, current * 2)
+        elif tokens >= capacity / 2 and current > 1:
+            _stretch[api_key] = max(1.0, current / 2)
+
+
+# Take a token for a request with the API key, or count tokens to reserve several requests at once (eg. every
+# page of an account, so it isn't turned away halfway through). Interactive requests wait up to quota_wait
+# seconds for them, background ones give up straight away. Returns False if the requests shouldn't be made.
+# If the budget can't be read from the db the requests are let through rather than failing because of it.
+def acquire(api_key, interactive=True, count=1):
+    if count <= 0:
+        return True
+    try:
+        if not interactive:
+            wait, tokens, capacity = take(api_key, interactive_reserve, count)
+            update_stretch(api_key, wait == 0, tokens, capacity)
+            if wait:
+                uptimerobot_quota_rejections.inc("background")
+                if debug_mode:
+                    print(f"Request budget for API key ...{api_key[-4:]} is low, polling it every {stretch(api_key):g} intervals.")
+                return False
+            return True
+
+        deadline = time.monotonic() + quota_wait
+        while True:
+            wait, tokens, capacity = take(api_key, count=count)
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                uptimerobot_quota_rejections.inc("interactive")
+                return False
+            uptimerobot_quota_wait_seconds.inc(amount=wait)
+            time.sleep(wait)
+    except sqlite3.Error as e:
+        print(f"Error reading the request budget of API key ...{api_key[-4:]}: {e}")
+        return True
+
+
+# Keep a key's bucket in line with what UptimeRobot says about its rate limit
+def observe_response(api_key, status_code, headers):
+    limit = headers.get("X-RateLimit-Limit")
+    remaining = headers.get("X-RateLimit-Remaining")
+    limit = int(limit) if limit and limit.isdigit() else None
+    remaining = int(remaining) if remaining and remaining.isdigit() else None
+    blocked_until = 0
+    if status_code == 429:
+        retry_after = headers.get("Retry-After")
+        blocked_until = time.time() + (float(retry_after) if retry_after and retry_after.isdigit() else 60)
+        remaining = 0
+        with _stretch_lock:
+            _stretch[api_key] = min(quota_max_stretch, _stretch.get(api_key, 1.0) * 2)
+    if limit is None and remaining is None:
+        return
+
+    now = time.time()
+    try:
+        with db.transaction() as conn:
+            ensure_bucket(api_key, conn)
+            conn.execute(
+                f"UPDATE uptime_request_budgets SET tokens = MIN({refilled(now)}, COALESCE(?, capacity), COALESCE(?, capacity)), capacity = MAX(1, COALESCE(?, capacity)), updated_at = ?, blocked_until = MAX(blocked_until, ?) WHERE api_key = ?",
+                (limit, remaining, limit, now, blocked_until, api_key)
+            )
+    except sqlite3.Error as e:
+        print(f"Error saving the request budget of API key ...{api_key[-4:]}: {e}")
+
+
+# How many times its normal interval the scheduler should wait between polls of the key's sites
+def stretch(api_key):
+    return _stretch.get(api_key, 1.0)
+
+
+def stretched_count():
+    with _stretch_lock:
+        return sum(1 for value in _stretch.values() if value > 1)
+
+
+Gauge("uptimerobot_stretched_api_keys", "API keys polled less often than usual because their request budget ran low.", stretched_count)
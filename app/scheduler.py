@@ -0,0 +1,189 @@
+from dotenv import load_dotenv
+import random
+import sqlite3
+import heapq
+import math
+import zlib
+import time
+import os
+import db
+import webhooks
+import quotas
+from metrics import scheduler_overruns, scheduler_missed_ticks
+
+
+# Priority queue scheduler for the site checks.
+# Every site has its own next due time in a heap instead of everything being checked on the minute.
+# Each account gets a stable offset inside the interval (plus a little random jitter per site) so the
+# UptimeRobot requests are spread over the whole minute. When a site comes due, the other sites on the
+# same account that are due soon are checked with it so an account is still fetched once per interval.
+# Checks that overrun skip the ticks they missed rather than queueing them up, and paused sites are
+# checked less and less often until they're unpaused.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+# Default seconds between checks of a site. A site can override it with monitor_sites.check_interval.
+schedule_interval = int(os.getenv("SCHEDULE_INTERVAL", 60))
+# Up to this many seconds of random delay is added to every check
+schedule_jitter = float(os.getenv("SCHEDULE_JITTER", 5))
+# Sites due within this many seconds are checked along with a due site on the same account
+schedule_coalesce = float(os.getenv("SCHEDULE_COALESCE", 15))
+# Paused sites back off (doubling each check) up to this many seconds between checks
+schedule_paused_max_interval = int(os.getenv("SCHEDULE_PAUSED_MAX_INTERVAL", 900))
+# Sites on accounts in push mode (UptimeRobot webhooks) are only polled this often, to catch missed alerts
+webhook_reconcile_interval = int(os.getenv("WEBHOOK_RECONCILE_INTERVAL", 900))
+# How often the site list is reloaded from the db to pick up added and removed sites
+schedule_sync_interval = int(os.getenv("SCHEDULE_SYNC_INTERVAL", 30))
+
+
+class SiteEntry:
+    __slots__ = ("site", "check_interval", "base_due", "due", "version", "paused_checks", "push")  # There's one per site
+
+    def __init__(self, site, check_interval):
+        self.site = site  # (user_id, channel_id, website, api_key, last_status, monitor_id)
+        self.check_interval = check_interval
+        self.base_due = 0  # When the site is due without jitter, so the jitter doesn't add up over time
+        self.due = 0
+        self.version = 0  # Bumped on every reschedule, older heap items for the site are ignored
+        self.paused_checks = 0
+        self.push = False  # The account sends webhooks, so polling is only a reconciliation sweep
+
+    @property
+    def key(self):
+        return self.site[:3]
+
+
+# lease is an optional leases.RunnerLease. With one, only the sites whose API key this runner owns are scheduled.
+class SiteScheduler:
+    def __init__(self, check_sites, lease=None):
+        self.check_sites = check_sites
+        self.lease = lease
+        self.lease_version = None
+        self.entries = {}
+        self.keys_by_api_key = {}
+        self.heap = []
+        self.last_sync = None
+        self.overruns = 0
+        self.missed_ticks = 0
+
+    def interval_for(self, entry):
+        interval = entry.check_interval or (webhook_reconcile_interval if entry.push else schedule_interval)
+        if entry.paused_checks:
+            interval = min(interval * 2 ** entry.paused_checks, max(schedule_paused_max_interval, interval))
+        # Poll less often while the API key is short on request budget
+        return interval * quotas.stretch(entry.site[3])
+
+    def schedule(self, entry, base_due):
+        entry.base_due = base_due
+        entry.due = base_due + random.uniform(0, schedule_jitter)
+        entry.version += 1
+        heapq.heappush(self.heap, (entry.due, entry.version, entry.key))
+
+    # Pick up sites that were added, removed or changed in the db. The rows are streamed from the db rather
+    # than loaded all at once, so a sync only adds the rows it's looking at to the entries that are kept.
+    def sync(self, now):
+        if self.lease:
+            self.lease_version = self.lease.version
+        push_api_keys = webhooks.push_enabled_api_keys()
+        seen = set()
+        # Sites without an API key can't be checked (or placed on the lease's ring), so they're left out
+        for row in db.iter_rows("SELECT user_id, channel_id, website, api_key, last_status, monitor_id, check_interval FROM monitor_sites WHERE api_key IS NOT NULL"):
+            if self.lease and not self.lease.owns(row[3]):
+                continue
+            site = tuple(row[:6])
+            key = site[:3]
+            seen.add(key)
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = SiteEntry(site, row[6])
+                entry.push = site[3] in push_api_keys
+                self.entries[key] = entry
+                self.keys_by_api_key.setdefault(site[3], set()).add(key)
+                offset = zlib.crc32(site[3].encode()) % self.interval_for(entry)
+                self.schedule(entry, now + offset)
+            else:
+                if entry.site[3] != site[3]:
+                    self.keys_by_api_key[entry.site[3]].discard(key)
+                    self.keys_by_api_key.setdefault(site[3], set()).add(key)
+                entry.site = site
+                entry.check_interval = row[6]
+                push = site[3] in push_api_keys
+                if push != entry.push:
+                    # Move the site onto its new interval now rather than after its next check
+                    entry.push = push
+                    self.schedule(entry, min(entry.base_due, now + self.interval_for(entry)))
+
+        for key in set(self.entries) - seen:
+            entry = self.entries.pop(key)
+            self.keys_by_api_key[entry.site[3]].discard(key)
+        self.last_sync = now
+
+    # Pop every site that's due, plus the sites on the same accounts that are nearly due
+    def pop_due(self, now):
+        due_keys = set()
+        while self.heap and self.heap[0][0] <= now:
+            due, version, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is None or entry.version != version:
+                continue  # Removed or rescheduled since this was pushed
+            due_keys.add(key)
+
+        for api_key in {self.entries[key].site[3] for key in due_keys}:
+            for key in self.keys_by_api_key[api_key]:
+                if self.entries[key].due <= now + schedule_coalesce:
+                    due_keys.add(key)
+        return [self.entries[key] for key in due_keys]
+
+    def run_batch(self, entries):
+        statuses = self.check_sites([entry.site for entry in entries])
+        if isinstance(statuses, str):
+            print(statuses)
+            statuses = {}
+
+        finished = time.monotonic()
+        overran = 0
+        for entry in entries:
+            status = statuses.get(entry.key)
+            if status is not None:
+                entry.site = entry.site[:4] + (status,) + entry.site[5:]
+            entry.paused_checks = entry.paused_checks + 1 if status == 0 else 0
+
+            interval = self.interval_for(entry)
+            base_due = entry.base_due + interval
+            if base_due <= finished:
+                # The check ran past the next tick. Skip the missed ticks instead of running them back to back.
+                missed = math.floor((finished - base_due) / interval) + 1
+                base_due += missed * interval
+                self.missed_ticks += missed
+                scheduler_missed_ticks.inc(amount=missed)
+                overran += 1
+            if entry.key in self.entries:
+                self.schedule(entry, base_due)
+
+        if overran:
+            self.overruns += 1
+            scheduler_overruns.inc()
+            print(f"Warning: check of {len(entries)} sites overran the next tick for {overran} of them. Total missed ticks: {self.missed_ticks}.")
+
+    def run(self):
+        while True:
+            now = time.monotonic()
+            # Re-sync straight away when runners join or leave so sites move to their new owner
+            lease_changed = self.lease is not None and self.lease.version != self.lease_version
+            if self.last_sync is None or lease_changed or now - self.last_sync >= schedule_sync_interval:
+                try:
+                    self.sync(now)
+                except sqlite3.Error as e:
+                    print(f"Error loading sites from the database: {e}")
+
+            due = self.pop_due(now)
+            if due:
+                if debug_mode:
+                    print(f"{len(due)} sites due, {len(self.entries)} sites scheduled.")
+                self.run_batch(due)
+                continue
+
+            next_due = self.heap[0][0] if self.heap else now + 1
+            time.sleep(min(max(next_due - now, 0.05), 1))
@@ -1,3 +1,12 @@
-from app import run_schedule
+import time
 
-run_schedule()
\ No newline at end of file
+# Only the check and notify code is loaded here, not the web app, so a runner starts quickly and
+# uses less memory. How long the imports took is printed on startup.
+import_start = time.perf_counter()
+from checks import run_schedule
+import migrations
+print(f"Schedule runner loaded in {time.perf_counter() - import_start:.2f}s.")
+
+migrations.migrate()
+
+run_schedule()
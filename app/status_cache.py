@@ -0,0 +1,120 @@
+from dotenv import load_dotenv
+from collections import OrderedDict
+import threading
+import time
+import os
+from metrics import Gauge, CounterFunc
+
+
+# In-memory cache of UptimeRobot monitors keyed by (api_key, website).
+# Entries expire after STATUS_CACHE_TTL seconds and the least recently used ones are dropped once there
+# are more than STATUS_CACHE_MAX_ENTRIES. When several threads ask for the same missing key at once only
+# the first one calls UptimeRobot and the others wait for its result.
+
+load_dotenv()
+
+status_cache_ttl = float(os.getenv("STATUS_CACHE_TTL", 60))
+status_cache_max_entries = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", 10000))
+
+
+class InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class StatusCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.store(key, value)
+
+    def store(self, key, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    # Get the cached value for key, calling fetch() to fill it on a miss.
+    # Only values for which cacheable(value) is true are stored, so errors aren't cached.
+    def get(self, key, fetch, cacheable=lambda value: True):
+        with self.lock:
+            value = self.lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            in_flight = self.in_flight.get(key)
+            if in_flight is None:
+                self.misses += 1
+                in_flight = InFlight()
+                self.in_flight[key] = in_flight
+                owner = True
+            else:
+                self.shared += 1
+                owner = False
+
+        if not owner:
+            in_flight.done.wait()
+            return in_flight.value
+
+        try:
+            in_flight.value = fetch()
+        finally:
+            with self.lock:
+                if in_flight.value is not None and cacheable(in_flight.value):
+                    self.store(key, in_flight.value)
+                del self.in_flight[key]
+            in_flight.done.set()
+        return in_flight.value
+
+    # The cached value for key or None, without fetching it on a miss. For callers that fetch the misses
+    # themselves in a batch.
+    def peek(self, key):
+        with self.lock:
+            value = self.lookup(key)
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_fetches": self.shared,
+            }
+
+
+monitor_cache = StatusCache(status_cache_ttl, status_cache_max_entries)
+
+Gauge("status_cache_entries", "Monitors held in the status cache.", lambda: monitor_cache.stats()["entries"])
+CounterFunc("status_cache_hits_total", "Status cache lookups answered from the cache.", lambda: monitor_cache.stats()["hits"])
+CounterFunc("status_cache_misses_total", "Status cache lookups that weren't in the cache.", lambda: monitor_cache.stats()["misses"])
+CounterFunc("status_cache_shared_fetches_total", "Status cache lookups that waited on another thread's fetch.", lambda: monitor_cache.stats()["shared_fetches"])
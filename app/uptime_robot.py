@@ -0,0 +1,590 @@
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import itertools
+import json
+import os
+import re
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import time
+from status_cache import monitor_cache
+from breaker import CircuitBreaker, BreakerGroup
+import db
+import profiling
+import quotas
+from metrics import Gauge, uptimerobot_request_seconds, uptimerobot_errors, uptimerobot_retries, uptimerobot_breaker_rejections
+
+
+# Shared UptimeRobot API client. Everything that talks to UptimeRobot goes through the one long-lived
+# session in here so connections are kept alive and reused instead of paying a new TCP/TLS handshake
+# on every status check.
+
+load_dotenv()
+
+debug_mode = os.getenv("DEBUG_MODE", False) in ("True", "1", "yes")
+
+uptime_api_url = os.getenv("UPTIME_API_URL", "https://api.uptimerobot.com/v2/getMonitors")
+if not re.match(r"^https?://", uptime_api_url):
+    uptime_api_url = f"https://{uptime_api_url}"
+uptime_page_size = 50
+
+# How many UptimeRobot requests the scheduled check can have in flight, in total and per API key
+check_concurrency = int(os.getenv("CHECK_CONCURRENCY", 8))
+check_concurrency_per_key = int(os.getenv("CHECK_CONCURRENCY_PER_KEY", 2))
+
+# Connection pool and timeouts (seconds) for the shared session
+uptime_pool_size = int(os.getenv("UPTIME_POOL_SIZE", max(check_concurrency, 10)))
+uptime_connect_timeout = float(os.getenv("UPTIME_CONNECT_TIMEOUT", 3.05))
+uptime_read_timeout = float(os.getenv("UPTIME_READ_TIMEOUT", 10))
+# Retries of failed requests (connection errors and 5xx responses), with 0.5s, 1s, 2s... between them
+uptime_retries = int(os.getenv("UPTIME_RETRIES", 1))
+
+# Circuit breakers: one per API key and one for UptimeRobot as a whole. They open after this many failed
+# calls in a row and let a trial call through every UPTIME_BREAKER_RESET seconds while open.
+uptime_breaker_failures = int(os.getenv("UPTIME_BREAKER_FAILURES", 5))
+uptime_global_breaker_failures = int(os.getenv("UPTIME_GLOBAL_BREAKER_FAILURES", 20))
+uptime_breaker_reset = float(os.getenv("UPTIME_BREAKER_RESET", 30))
+
+# The scheduled check stops waiting for accounts that haven't been fetched after this many seconds
+check_cycle_deadline = float(os.getenv("CHECK_CYCLE_DEADLINE", 45))
+
+# getMonitors can't pick fields, but all of its optional sections can be turned off. Only the id,
+# friendly_name, url and status of each monitor are used.
+minimal_fields = {
+    "logs": 0,
+    "alert_contacts": 0,
+    "mwindows": 0,
+    "response_times": 0,
+    "ssl": 0,
+    "custom_http_headers": 0,
+    "custom_http_statuses": 0,
+    "all_time_uptime_ratio": 0,
+    "timezone": 0,
+}
+
+friendly_statuses = {
+    0: "Paused",
+    1: "Not checked yet",
+    2: "Up",
+    8: "Seems down",
+    9: "Down",
+}
+
+_session = None
+_session_lock = threading.Lock()
+_fetch_executor = None
+
+upstream_breaker = CircuitBreaker("upstream", uptime_global_breaker_failures, uptime_breaker_reset)
+api_key_breakers = BreakerGroup("api key", uptime_breaker_failures, uptime_breaker_reset)
+
+Gauge("uptimerobot_upstream_breaker_open", "1 while the UptimeRobot circuit breaker is open.", lambda: int(upstream_breaker.is_open))
+Gauge("uptimerobot_api_key_breakers_open", "API keys whose circuit breaker is open.", api_key_breakers.open_count)
+
+
+# Raised instead of calling UptimeRobot while a circuit breaker is open
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+
+# Raised instead of calling UptimeRobot when the API key's request budget is used up
+class QuotaExceededError(requests.exceptions.RequestException):
+    pass
+
+
+quota_exceeded_message = "UptimeRobot's rate limit for this API key has been reached. Try again in a minute."
+
+
+# Retry policy that counts every retry it makes for the metrics
+class CountingRetry(Retry):
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and response.status:
+            reason = f"status_{response.status}"
+        else:
+            reason = type(error).__name__ if error else "unknown"
+        uptimerobot_retries.inc(reason)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def build_uptime_session():
+    session = requests.Session()
+    retries = CountingRetry(
+        total=uptime_retries,    # Total number of retries
+        backoff_factor=0.5,      # Wait 0.5s, 1s, 2s... between retries
+        status_forcelist=[500, 502, 503, 504],  # Retry on these HTTP status codes
+        allowed_methods=["POST"],  # Retry only POST requests
+        # A 429's Retry-After is left to the request budget (see quotas.py), retrying it here would sleep in
+        # the calling thread and send another request without taking a token
+        respect_retry_after_header=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,  # All requests go to the same host
+        pool_maxsize=uptime_pool_size,
+        pool_block=True,  # Wait for a free connection rather than opening throwaway ones
+        max_retries=retries
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+# The session is created once per process. urllib3's connection pool is thread safe so the
+# scheduler's worker threads and the web handlers can all share it.
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_uptime_session()
+    return _session
+
+
+# Worker threads for stream_account_monitors, started once per process and shared by every stream so a check
+# doesn't start (and its threads don't reconnect to the db) each time
+def get_fetch_executor():
+    global _fetch_executor
+    if _fetch_executor is None:
+        with _session_lock:
+            if _fetch_executor is None:
+                _fetch_executor = ThreadPoolExecutor(max_workers=check_concurrency, thread_name_prefix="uptimerobot-fetch")
+    return _fetch_executor
+
+
+# POST to getMonitors with the shared session and return the decoded JSON.
+# operation is only used to label the metrics. interactive requests (commands) get priority over background
+# polling for the API key's request budget (see quotas.py). CircuitOpenError is raised without calling
+# UptimeRobot if UptimeRobot's breaker or the API key's is open, and then QuotaExceededError the same way if
+# there isn't any budget left. Errors and 5xx responses count against both breakers, other failed responses (eg. a
+# bad API key) only against the API key's. 429s are left to the request budget.
+# tokens is how many requests to take from the budget for this one, more to reserve the requests that follow
+# it or 0 if they were already reserved.
+def post_get_monitors(params, operation="getMonitors", interactive=True, tokens=1):
+    api_key = params.get("api_key") or ""
+    key_breaker = api_key_breakers.get(api_key)
+    if not upstream_breaker.allow():
+        uptimerobot_breaker_rejections.inc("upstream")
+        raise CircuitOpenError("UptimeRobot is failing, skipping the request for now.")
+    if not key_breaker.allow():
+        uptimerobot_breaker_rejections.inc("api_key")
+        raise CircuitOpenError("Requests for this API key keep failing, skipping the request for now.")
+    # Only take a token for requests the breakers let through
+    if not quotas.acquire(api_key, interactive, tokens):
+        raise QuotaExceededError(quota_exceeded_message)
+
+    response = None
+    try:
+        with uptimerobot_request_seconds.time(operation), profiling.phase("uptimerobot"):
+            response = get_session().post(
+                uptime_api_url,
+                data={**params, **minimal_fields},
+                timeout=(uptime_connect_timeout, uptime_read_timeout)
+            )
+            quotas.observe_response(api_key, response.status_code, response.headers)
+            data = response.json()
+    except Exception as e:
+        uptimerobot_errors.inc(type(e).__name__)
+        if response is None or response.status_code != 429:
+            upstream_breaker.record_failure()
+            key_breaker.record_failure()
+        raise
+
+    if response.status_code >= 500:
+        upstream_breaker.record_failure()
+        key_breaker.record_failure()
+    elif response.status_code == 429:
+        upstream_breaker.record_success()  # UptimeRobot is fine, the key is just over its rate limit
+    elif data.get("stat") != "ok":
+        upstream_breaker.record_success()
+        key_breaker.record_failure()
+    else:
+        upstream_breaker.record_success()
+        key_breaker.record_success()
+    if data.get("stat") != "ok":
+        uptimerobot_errors.inc("invalid_response")
+    return data
+
+
+# The stored monitor id of a site that's being monitored, if there is one
+def stored_monitor_id(website, uptime_api_key):
+    row = db.fetch_one("SELECT monitor_id FROM monitor_sites WHERE website = ? AND api_key = ? AND monitor_id IS NOT NULL LIMIT 1", (website, uptime_api_key))
+    return row[0] if row else None
+
+
+# Look up a single website's monitor. Returns the monitor or an error string.
+# Sites that are already monitored are looked up by their monitor id, others by name.
+def fetch_monitor(website, uptime_api_key):
+    try:
+        monitor_id = stored_monitor_id(website, uptime_api_key)
+    except Exception as e:
+        monitor_id = None  # Looking up by name still works
+        if debug_mode:
+            print(f"Error reading the monitor id of {website}: {e}")
+    if debug_mode:
+        print(f"{uptime_api_url} monitors={website if monitor_id is None else monitor_id}")
+
+    try:
+        data = post_get_monitors({
+            "api_key": uptime_api_key,
+            "format": "json",
+            "monitors": website if monitor_id is None else monitor_id,
+        }, "monitor")
+    except requests.exceptions.Timeout as e:
+        return f"Request timed out: {e}"
+    except requests.exceptions.TooManyRedirects as e:
+        return f"Too many redirects: {e}"
+    except requests.exceptions.HTTPError as e:
+        return f"HTTP error occurred: {e}"
+    except requests.exceptions.ConnectionError as e:
+        return f"Connection error occurred: {e}"
+    except requests.exceptions.RequestException as e:
+        return f"Error fetching status: {e}"
+    except json.JSONDecodeError as e:
+        return f"Error decoding JSON response: {e}"
+    except ValueError as e:
+        return f"Error parsing JSON response: {e}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+    if data.get("stat") != "ok":
+        return "Error fetching status: Invalid response from UptimeRobot API."
+    if not data.get("monitors"):
+        return "No monitors found for the provided website."
+
+    monitors = data["monitors"]
+    if len(monitors) == 1 or monitor_id is not None:
+        return monitors[0]
+    monitor = next((monitor for monitor in monitors if monitor["friendly_name"] == website), None)
+    if not monitor:
+        return "No monitors found for the provided website."
+    return monitor
+
+
+# A monitor made up from the status the schedule runner saved for a site
+class SavedMonitor(dict):
+    pass
+
+
+# The status the schedule runner saved for a site, if it checked the site within the status cache's TTL.
+# Returns a SavedMonitor or None.
+def saved_monitor(website, uptime_api_key):
+    try:
+        row = db.fetch_one(
+            "SELECT last_status, monitor_id, monitor_url, last_checked_at FROM monitor_sites WHERE api_key = ? AND website = ? AND last_checked_at >= ? ORDER BY last_checked_at DESC LIMIT 1",
+            (uptime_api_key, website, time.time() - monitor_cache.ttl)
+        )
+    except Exception as e:
+        if debug_mode:
+            print(f"Error reading the saved status of {website}: {e}")
+        return None
+    return fresh_saved_monitor(website, *row) if row else None
+
+
+# A SavedMonitor from a monitor_sites row's last_status, monitor_id, monitor_url and last_checked_at, or None
+# if the site wasn't checked within the status cache's TTL
+def fresh_saved_monitor(website, last_status, monitor_id, monitor_url, last_checked_at):
+    if not last_checked_at or last_checked_at < time.time() - monitor_cache.ttl or not str(last_status).isdigit():
+        return None
+    return SavedMonitor(id=monitor_id, friendly_name=website, url=monitor_url or website, status=int(last_status))
+
+
+# Get a website's monitor. It comes from the status cache if it was looked up (or polled by a scheduler in
+# this process) recently, otherwise from the status the schedule runner saved if it's as fresh as the cache
+# would be, and only otherwise from UptimeRobot. The schedule runner is a separate process, so the db is
+# how its results reach the web app's commands. Saved statuses aren't cached, they're already as old as
+# the check that saved them.
+def get_monitor(website, uptime_api_key):
+    return monitor_cache.get(
+        (uptime_api_key, website),
+        lambda: saved_monitor(website, uptime_api_key) or fetch_monitor(website, uptime_api_key),
+        cacheable=lambda monitor: type(monitor) is dict
+    )
+
+
+# Save the scheduler's results in the status cache so commands run right after a check in the same process
+# can reuse them
+def cache_monitors(uptime_api_key, monitors_by_website, websites):
+    for website in websites:
+        monitor = monitors_by_website.get(website)
+        if monitor:
+            monitor_cache.put((uptime_api_key, website), monitor)
+
+
+# Look up the monitors for a stream of sites, yielding (site, monitor) for the sites of each account as the
+# account completes, with an error string in place of the monitor for sites that couldn't be looked up.
+# sites yields (website, api_key, monitor_id, saved, site) tuples in api_key order, where saved is the site's
+# fresh SavedMonitor or None. Sites in the status cache or with a fresh saved status are answered from those,
+# and the rest of each account is fetched with stream_account_monitors, which asks for up to uptime_page_size
+# monitors per request, so an account costs a few requests from its budget instead of one per site.
+def iter_monitors(sites, interactive=True):
+    def accounts():
+        for uptime_api_key, account_sites in itertools.groupby(sites, key=lambda site: site[1]):
+            results = []
+            missing = []
+            for website, _, monitor_id, saved, site in account_sites:
+                monitor = monitor_cache.peek((uptime_api_key, website)) or saved
+                if monitor:
+                    results.append((site, monitor))
+                else:
+                    missing.append((website, monitor_id, site))
+            # Sites without a monitor id are matched by name, which needs all of the account's monitors. An
+            # account with nothing missing asks for no monitors and is passed straight through.
+            monitor_ids = sorted({monitor_id for _, monitor_id, _ in missing}) if all(monitor_id is not None for _, monitor_id, _ in missing) else None
+            yield uptime_api_key, monitor_ids, (results, missing)
+
+    for uptime_api_key, (results, missing), monitors in stream_account_monitors(accounts(), interactive=interactive):
+        yield from results
+        if isinstance(monitors, str):
+            for _, _, site in missing:
+                yield site, monitors
+            continue
+
+        by_id = {monitor.get("id"): monitor for monitor in monitors}
+        by_website = index_monitors(monitors)
+        matched = {}
+        for website, monitor_id, site in missing:
+            monitor = by_id.get(monitor_id) if monitor_id is not None else by_website.get(website)
+            if monitor:
+                matched[website] = monitor
+            yield site, monitor or "No monitors found for the provided website."
+        cache_monitors(uptime_api_key, matched, list(matched))
+
+
+# Get the status of a website using UptimeRobot API
+def get_status(website, uptime_api_key, mode="response"):
+    monitor = get_monitor(website, uptime_api_key)
+    if isinstance(monitor, str):
+        return monitor
+
+    friendly_name = monitor["friendly_name"]
+    url = monitor["url"]
+    status = monitor["status"]
+    friendly_status = friendly_statuses.get(status, "Unknown")
+
+    if mode == "response":
+        response = f"Website: {friendly_name}\nStatus: {friendly_status} (Status code: {status})\nURL: {url}"
+        return response
+    elif mode == "plain":
+        return status
+    else:
+        return "Invalid mode specified. Use 'response' or 'plain'."
+
+
+# Get one page of an account's monitors. Returns (monitors, total) or an error string.
+def get_monitors_page(uptime_api_key, offset, interactive=True, tokens=1):
+    try:
+        data = post_get_monitors({
+            "api_key": uptime_api_key,
+            "format": "json",
+            "offset": offset,
+            "limit": uptime_page_size,
+        }, "account_page", interactive, tokens)
+    except requests.exceptions.RequestException as e:
+        return f"Error fetching monitors: {e}"
+    except ValueError as e:
+        return f"Error parsing JSON response: {e}"
+
+    if data.get("stat") != "ok":
+        return "Error fetching monitors: Invalid response from UptimeRobot API."
+
+    monitors = data.get("monitors") or []
+    pagination = data.get("pagination") or {}
+    total = pagination.get("total", offset + len(monitors))
+    return monitors, total
+
+
+# Get specific monitors of an account by id (at most uptime_page_size of them). Returns (monitors, total)
+# like get_monitors_page, or an error string.
+def get_monitors_by_id(uptime_api_key, monitor_ids, interactive=True, tokens=1):
+    try:
+        data = post_get_monitors({
+            "api_key": uptime_api_key,
+            "format": "json",
+            "monitors": "-".join(str(monitor_id) for monitor_id in monitor_ids),
+            "limit": uptime_page_size,
+        }, "monitors_by_id", interactive, tokens)
+    except requests.exceptions.RequestException as e:
+        return f"Error fetching monitors: {e}"
+    except ValueError as e:
+        return f"Error parsing JSON response: {e}"
+
+    if data.get("stat") != "ok":
+        return "Error fetching monitors: Invalid response from UptimeRobot API."
+
+    monitors = data.get("monitors") or []
+    return monitors, len(monitors)
+
+
+# An account being fetched by stream_account_monitors
+class AccountFetch:
+    def __init__(self, api_key, monitor_ids, data):
+        self.api_key = api_key
+        self.data = data
+        ids = list(monitor_ids or [])
+        # A part is (offset, None) for a page of the account or (offset, ids) for a chunk of monitor ids
+        self.pending_parts = [(i, ids[i:i + uptime_page_size]) for i in range(0, len(ids), uptime_page_size)] or [(0, None)]
+        self.pages = {}
+        self.in_flight = 0
+        self.failed = False
+        self.reserved = False
+
+
+# Page offsets of an account after the first page, given the first page's size and the account's total
+def later_page_offsets(first_page_size, total):
+    return range(first_page_size, total, first_page_size) if first_page_size else range(0)
+
+
+# How many pages each account had when its monitors were last fetched, so the next fetch can reserve them all
+# before its first request
+_page_counts = {}
+
+
+# Fetch one part of an account for stream_account_monitors, taking tokens from the request budget first.
+# The first part of an account reserves the budget for all of it: a chunk of monitor ids takes a token for
+# every chunk, and the first page takes one for each page the account had last time and then any more it
+# turns out to need. The account fails there if there isn't enough, before its other requests are made.
+# Returns what get_monitors_by_id or get_monitors_page does, with an error string for anything unexpected
+# so it only fails this account.
+def fetch_account_part(uptime_api_key, offset, ids, interactive, tokens):
+    profiling.join_thread()  # The worker threads outlive any one profiled cycle
+    try:
+        return fetch_account_part_budgeted(uptime_api_key, offset, ids, interactive, tokens)
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+
+def fetch_account_part_budgeted(uptime_api_key, offset, ids, interactive, tokens):
+    if ids:
+        return get_monitors_by_id(uptime_api_key, ids, interactive, tokens)
+    page = get_monitors_page(uptime_api_key, offset, interactive, tokens)
+    if tokens and not isinstance(page, str):
+        monitors, total = page
+        page_count = len(later_page_offsets(len(monitors), total)) + 1
+        _page_counts[uptime_api_key] = page_count
+        if not quotas.acquire(uptime_api_key, interactive, page_count - tokens):
+            return f"Error fetching monitors: {quota_exceeded_message}"
+    return page
+
+
+# Get the monitors of a stream of UptimeRobot accounts, yielding (api_key, data, monitors) as each account is
+# done, with an error string in place of the monitors for accounts that failed.
+# accounts is an iterable of (api_key, monitor_ids, data). Accounts with monitor_ids only get those monitors,
+# requested by id in chunks of uptime_page_size, and are yielded straight away with no monitors if it's empty.
+# Accounts with None get all of their monitors. data is passed through.
+# getMonitors is paginated (max 50 per page) so after the first page of an account comes back the rest of its
+# pages are fetched in parallel. Each account's request budget is reserved by its first request (see
+# fetch_account_part), so an account is never given up on for budget halfway through. At most check_concurrency
+# requests are in flight overall and at most check_concurrency_per_key for any one account, and the next
+# account is only taken from accounts when there's a free slot, so a long stream is never all in memory at once.
+# Accounts that haven't been fetched by the deadline (a time.monotonic() time) are given up on, without
+# waiting for their requests to finish. The scheduler passes interactive=False so its requests don't use
+# the part of each API key's request budget kept for commands.
+def stream_account_monitors(accounts, deadline=None, interactive=True):
+    accounts = iter(accounts)
+    futures = {}
+    open_accounts = []
+    exhausted = False
+
+    executor = get_fetch_executor()
+    try:
+        def submit_pending(account):
+            while account.pending_parts and account.in_flight < check_concurrency_per_key:
+                if not account.reserved and account.in_flight:
+                    break  # The rest of the account waits for its first part to reserve their budget
+                if account.reserved:
+                    tokens = 0
+                elif account.pending_parts[0][1]:
+                    tokens = len(account.pending_parts)
+                else:
+                    tokens = _page_counts.get(account.api_key, 1)
+                offset, ids = account.pending_parts.pop(0)
+                future = executor.submit(fetch_account_part, account.api_key, offset, ids, interactive, tokens)
+                futures[future] = (account, offset, ids)
+                account.in_flight += 1
+
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                # Give up on the accounts being fetched and don't start any more
+                error = "Deadline passed before the monitors were fetched, not checked."
+                for account in open_accounts:
+                    yield account.api_key, account.data, error
+                for api_key, monitor_ids, data in accounts:
+                    yield api_key, data, error
+                return
+
+            while not exhausted and len(futures) < check_concurrency:
+                account = next(accounts, None)
+                if account is None:
+                    exhausted = True
+                    break
+                if account[1] is not None and not account[1]:
+                    yield account[0], account[2], []  # Nothing to fetch
+                    continue
+                account = AccountFetch(*account)
+                open_accounts.append(account)
+                submit_pending(account)
+            if not futures:
+                return
+
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                account, offset, ids = futures.pop(future)
+                account.in_flight -= 1
+                if account.failed:
+                    continue  # Another page of this account already failed
+
+                page = future.result()
+                if isinstance(page, str):
+                    account.failed = True
+                    account.pending_parts = []
+                    open_accounts.remove(account)
+                    yield account.api_key, account.data, page
+                    continue
+
+                monitors, total = page
+                account.pages[offset] = monitors
+                if not account.reserved and not ids:
+                    account.pending_parts = [(page_offset, None) for page_offset in later_page_offsets(len(monitors), total)]
+                account.reserved = True
+
+                submit_pending(account)
+
+                if not account.pending_parts and account.in_flight == 0:
+                    open_accounts.remove(account)
+                    yield account.api_key, account.data, [monitor for page_offset in sorted(account.pages) for monitor in account.pages[page_offset]]
+    finally:
+        # Requests that haven't started aren't needed any more, the ones in flight finish on their own
+        for future in futures:
+            future.cancel()
+
+
+# Get the monitors for each of the given UptimeRobot accounts, see stream_account_monitors. monitor_ids is
+# {api_key: [monitor ids]}. Returns {api_key: [monitors]} with an error string in place of the list for
+# accounts that failed.
+def fetch_account_monitors(api_keys, monitor_ids=None, deadline=None):
+    monitor_ids = monitor_ids or {}
+    accounts = ((api_key, monitor_ids.get(api_key), None) for api_key in api_keys)
+    return {api_key: monitors for api_key, _, monitors in stream_account_monitors(accounts, deadline)}
+
+
+# Get every monitor on a single UptimeRobot account
+def get_account_monitors(uptime_api_key):
+    return fetch_account_monitors([uptime_api_key])[uptime_api_key]
+
+
+# Index an account's monitors so each row in monitor_sites can be matched locally.
+# Sites are stored without the scheme so match on the friendly name and on the monitor url's host.
+def index_monitors(monitors):
+    by_website = {}
+    for monitor in monitors:
+        url = monitor.get("url") or ""
+        host = re.sub(r"^https?://", "", url).split("/")[0]
+        if host:
+            by_website.setdefault(host, monitor)
+    # The friendly name wins over the url, same as get_status does when several monitors come back
+    for monitor in monitors:
+        if monitor.get("friendly_name"):
+            by_website[monitor["friendly_name"]] = monitor
+    return by_website
@@ -0,0 +1,77 @@
+from dotenv import load_dotenv
+import secrets
+import hashlib
+import hmac
+import json
+import time
+import os
+import db
+
+
+# Push mode: UptimeRobot webhook alert contacts.
+# An account (API key) that enables push mode gets a random secret, and its webhook's JSON POST body carries
+# the account's id and that secret. They're kept out of the URL so they don't end up in access logs. Alerts
+# posted to the webhook update the matching sites straight away, and the
+# scheduler only does a slow reconciliation sweep of push-enabled accounts instead of polling every minute.
+
+load_dotenv()
+
+# Public base URL of the web app, used to build the webhook URL to give to UptimeRobot
+public_url = os.getenv("PUBLIC_URL", "").rstrip("/")
+
+# UptimeRobot alertType values
+alert_statuses = {
+    1: 9,  # Down
+    2: 2,  # Up
+}
+
+
+def hash_secret(secret):
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+# Turn push mode on for an account, replacing any previous secret. Returns (account id, secret).
+def enable_account(api_key):
+    secret = secrets.token_urlsafe(32)
+    with db.transaction() as conn:
+        conn.execute(
+            "INSERT INTO webhook_accounts (api_key, secret_hash, push_enabled, created_at) VALUES (?, ?, 1, ?) ON CONFLICT(api_key) DO UPDATE SET secret_hash=excluded.secret_hash, push_enabled=1",
+            (api_key, hash_secret(secret), time.time())
+        )
+        account_id = conn.execute("SELECT id FROM webhook_accounts WHERE api_key = ?", (api_key,)).fetchone()[0]
+    return account_id, secret
+
+
+def disable_account(api_key):
+    return db.execute("UPDATE webhook_accounts SET push_enabled = 0 WHERE api_key = ?", (api_key,))
+
+
+# Get the API key of a push-enabled account if the secret matches, otherwise None
+def authenticate(account_id, secret):
+    if not account_id or not secret:
+        return None
+    row = db.fetch_one("SELECT api_key, secret_hash FROM webhook_accounts WHERE id = ? AND push_enabled = 1", (account_id,))
+    if not row or not hmac.compare_digest(row[1], hash_secret(secret)):
+        return None
+    return row[0]
+
+
+def push_enabled_api_keys():
+    return {row[0] for row in db.fetch_all("SELECT api_key FROM webhook_accounts WHERE push_enabled = 1")}
+
+
+def webhook_url():
+    return f"{public_url}/uptimerobot/webhook"
+
+
+# The POST value to give UptimeRobot for the account's webhook, sent as JSON. UptimeRobot fills in the
+# *...* variables for each alert.
+def webhook_body(account_id, secret):
+    return json.dumps({
+        "account": account_id,
+        "secret": secret,
+        "monitorID": "*monitorID*",
+        "monitorURL": "*monitorURL*",
+        "monitorFriendlyName": "*monitorFriendlyName*",
+        "alertType": "*alertType*",
+    })
@@ -0,0 +1,297 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import importlib.util
+import subprocess
+import threading
+import argparse
+import tempfile
+import requests
+import hashlib
+import socket
+import random
+import hmac
+import json
+import time
+import sys
+import os
+from fakes import FakeUptimeRobot, FakeSlack
+from bench_scheduler import seed_db, app_dir, sites_per_account
+
+
+# Load test for the web app's Slack endpoints.
+# Runs the app under gunicorn against local fake UptimeRobot and Slack servers and replays a mix of slash
+# commands (/slack/command), Remove button clicks (/slack/interactions) and app_home_opened events
+# (/slack/events), each signed with a test signing secret like Slack would. Every worker configuration
+# gets a fresh copy of the same seeded DB, and the latency percentiles and throughput are reported per
+# request type. Runs entirely offline.
+#
+#   python bench/bench_endpoints.py
+#   python bench/bench_endpoints.py --configs sync:1 gthread:1:8 gthread:2:8 --concurrency 32 --duration 30
+#   python bench/bench_endpoints.py --mix command=1 --latency 0.2
+
+signing_secret = "bench-signing-secret"
+
+# Worker classes that need a package that may not be installed
+worker_class_packages = {"gevent": "gevent", "eventlet": "eventlet"}
+
+
+def sign(body, timestamp):
+    basestring = f"v0:{timestamp}:{body}".encode()
+    return "v0=" + hmac.new(signing_secret.encode(), basestring, hashlib.sha256).hexdigest()
+
+
+# Requests are built from the seeded sites: account a has sites site-<a>-<i>.example.com on key-<a>, owned
+# by user U<a % 50> and posted to channel C<a % 20>
+class Payloads:
+    def __init__(self, site_count, response_url, seed=1):
+        self.accounts = max(1, site_count // sites_per_account)
+        self.response_url = response_url
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def site(self):
+        with self.lock:
+            account = self.random.randrange(self.accounts)
+            i = self.random.randrange(sites_per_account)
+            roll = self.random.random()
+        return account, f"site-{account}-{i}.example.com", roll
+
+    def command(self):
+        account, website, roll = self.site()
+        if roll < 0.5:
+            command, text = "/site-status", f"{website} | key-{account}"
+        elif roll < 0.8:
+            command, text = "/site-history", website
+        else:
+            command, text = "/monitor-site", f"{website} | key-{account}"
+        body = urlencode({
+            "command": command,
+            "text": text,
+            "user_id": f"U{account % 50:04d}",
+            "user_name": "bench",
+            "channel_id": f"C{account % 20:04d}",
+            "response_url": self.response_url,
+        })
+        return "/slack/command", body, "application/x-www-form-urlencoded"
+
+    def interaction(self):
+        account, website, roll = self.site()
+        payload = {
+            "type": "block_actions",
+            "user": {"id": f"U{account % 50:04d}"},
+            "actions": [{"type": "button", "action_id": "remove", "value": f"remove|{website}|C{account % 20:04d}"}],
+        }
+        return "/slack/interactions", urlencode({"payload": json.dumps(payload)}), "application/x-www-form-urlencoded"
+
+    def home(self):
+        account, website, roll = self.site()
+        event = {"type": "app_home_opened", "user": f"U{account % 50:04d}", "channel": "D0000", "tab": "home"}
+        # Most opens come with the view that was published last time
+        if roll < 0.9:
+            event["view"] = {"id": "V0000"}
+        body = json.dumps({
+            "token": "bench",
+            "team_id": "TBENCH",
+            "type": "event_callback",
+            "event_id": f"Ev{int(time.time() * 1000000)}",
+            "event_time": int(time.time()),
+            "event": event,
+        })
+        return "/slack/events", body, "application/json"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# "gthread:2:8" -> ("gthread", 2, 8)
+def parse_config(config):
+    parts = config.split(":")
+    worker_class = parts[0]
+    workers = int(parts[1]) if len(parts) > 1 else 1
+    threads = int(parts[2]) if len(parts) > 2 else 1
+    return worker_class, workers, threads
+
+
+def start_app(worker_class, workers, threads, db_path, uptime, slack, verbose):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "DB_PATH": db_path,
+        "UPTIME_API_URL": f"{uptime.url}/v2/getMonitors",
+        "SLACK_API_URL": f"{slack.url}/api/",
+        "SLACK_BOT_TOKEN": "xoxb-bench",
+        "SLACK_SIGNING_SECRET": signing_secret,
+        "DEBUG_MODE": "False",
+        # The fake UptimeRobot has no rate limit, so don't make commands wait for the request budgets
+        "UPTIME_RATE_LIMITS": "free=1000000,pro=1000000",
+    })
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "-w", str(workers), "-k", worker_class, "--threads", str(threads),
+            "-b", f"127.0.0.1:{port}", "--log-level", "warning",
+            "app:app",
+        ],
+        env=env,
+        cwd=app_dir,
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}, run with --verbose to see why")
+        try:
+            requests.get(f"{url}/metrics", timeout=1)
+            return process, url
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn didn't start within 30s")
+
+
+# Send requests from `concurrency` threads for `duration` seconds. Returns {kind: [(latency, status)]}.
+def run_load(url, payloads, mix, concurrency, duration):
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    results = {kind: [] for kind in kinds}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.monotonic() < stop_at:
+            kind = rng.choices(kinds, weights)[0]
+            path, body, content_type = getattr(payloads, kind)()
+            timestamp = str(int(time.time()))
+            headers = {
+                "Content-Type": content_type,
+                "X-Slack-Request-Timestamp": timestamp,
+                "X-Slack-Signature": sign(body, timestamp),
+            }
+            start = time.perf_counter()
+            try:
+                status = session.post(url + path, data=body.encode(), headers=headers, timeout=30).status_code
+            except requests.exceptions.RequestException:
+                status = 0
+            latency = time.perf_counter() - start
+            with lock:
+                results[kind].append((latency, status))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(client, seed) for seed in range(concurrency)]:
+            future.result()
+    return results
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(samples, duration):
+    latencies = sorted(latency for latency, status in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for latency, status in samples if status != 200),
+        "rps": len(samples) / duration,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def run_config(config, args, mix, uptime, slack):
+    worker_class, workers, threads = parse_config(config)
+    package = worker_class_packages.get(worker_class)
+    if package and importlib.util.find_spec(package) is None:
+        print(f"Skipping {config}: the {worker_class} worker class needs the {package} package.")
+        return None
+
+    uptime.reset()
+    slack.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        seed_db(db_path, args.sites)
+        process, url = start_app(worker_class, workers, threads, db_path, uptime, slack, args.verbose)
+        try:
+            payloads = Payloads(args.sites, f"{slack.url}/response")
+            # Warm up every worker's connections and caches before measuring
+            run_load(url, payloads, mix, args.concurrency, min(2, args.duration))
+            uptime.reset()
+            slack.reset()
+            results = run_load(url, payloads, mix, args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    summary = {"config": config, "kinds": {kind: summarize(samples, args.duration) for kind, samples in results.items()}}
+    summary["total"] = summarize([sample for samples in results.values() for sample in samples], args.duration)
+    summary["uptime_requests"] = dict(uptime.counts)
+    summary["slack_requests"] = dict(slack.counts)
+    return summary
+
+
+def report(summaries):
+    print(f"{'config':<14} {'kind':<12} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for summary in summaries:
+        for kind, stats in list(summary["kinds"].items()) + [("total", summary["total"])]:
+            print(
+                f"{summary['config']:<14} {kind:<12} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>8.1f} "
+                f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}"
+            )
+
+
+# "command=5" -> ("command", 5.0)
+def parse_mix(values):
+    mix = {}
+    for value in values:
+        kind, _, weight = value.partition("=")
+        if kind not in ("command", "interaction", "home"):
+            raise SystemExit(f"Unknown request kind {kind}, use command, interaction or home.")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Slack endpoints under gunicorn against local fake UptimeRobot and Slack servers.")
+    parser.add_argument("--configs", nargs="+", default=["sync:1", "gthread:1:4", "gthread:1:16"], help="gunicorn worker configurations as class:workers[:threads]")
+    parser.add_argument("--mix", nargs="+", default=["command=5", "interaction=2", "home=3"], help="request kinds and their weights")
+    parser.add_argument("--sites", type=int, default=1000, help="sites to seed the DB with")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run each configuration for")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds of latency the fakes add to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests the fakes fail with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests the fakes fail with a 429")
+    parser.add_argument("--json", action="store_true", help="print the raw results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show gunicorn's output")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    uptime = FakeUptimeRobot(
+        monitors_per_account=sites_per_account,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    ).start()
+    slack = FakeSlack(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate).start()
+    try:
+        summaries = [summary for summary in (run_config(config, args, mix, uptime, slack) for config in args.configs) if summary]
+    finally:
+        uptime.stop()
+        slack.stop()
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        report(summaries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import subprocess
+import resource
+import tempfile
+import sqlite3
+import json
+import time
+import sys
+import os
+from fakes import FakeUptimeRobot, FakeSlack
+
+
+# Scheduler throughput benchmark.
+# Starts local fake UptimeRobot and Slack servers, seeds a temporary DB with each requested number of
+# sites and runs full check cycles against them through the schedule runner's scheduler in a fresh process
+# per size, then reports sync and cycle times, requests issued, peak memory, notifications sent and the sites
+# that were skipped (and the requests the request budgets turned away) instead of being checked. Runs
+# entirely offline.
+#
+#   python bench/bench_scheduler.py
+#   python bench/bench_scheduler.py --sizes 10 1000 --cycles 5 --latency 0.05 --error-rate 0.02
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+app_dir = os.path.join(repo_dir, "app")
+
+# Sites are spread over accounts of this many monitors each
+sites_per_account = 100
+
+
+def seed_db(path, site_count):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE monitor_sites (
+        id INTEGER PRIMARY KEY,
+        time_added DATETIME DEFAULT CURRENT_TIMESTAMP,
+        user_id text,
+        channel_id TEXT,
+        website TEXT,
+        api_key TEXT,
+        last_status TEXT
+    )""")
+    rows = []
+    for n in range(site_count):
+        account, i = divmod(n, sites_per_account)
+        rows.append((f"U{account % 50:04d}", f"C{account % 20:04d}", f"site-{account}-{i}.example.com", f"key-{account}", 2))
+    conn.executemany("INSERT INTO monitor_sites (user_id, channel_id, website, api_key, last_status) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+# Runs in the child process: import the check code against the fakes and time the cycles. The cycles go
+# through the same SiteScheduler and check_sites as the schedule runner, with every site due at once: each
+# cycle syncs the sites from the db (like the runner does every SCHEDULE_SYNC_INTERVAL) and checks all of them.
+def run_child(cycles, result_path):
+    sys.path.insert(0, app_dir)
+    start = time.perf_counter()
+    import checks
+    import migrations
+    import outbox
+    import jobs
+    import metrics
+    from scheduler import SiteScheduler
+    import_seconds = time.perf_counter() - start
+    migrations.migrate()
+
+    scheduler = SiteScheduler(checks.check_sites)
+    sync_seconds = []
+    cycle_seconds = []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        scheduler.sync(time.monotonic())
+        sync_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        scheduler.run_batch(scheduler.pop_due(float("inf")))
+        cycle_seconds.append(time.perf_counter() - start)
+
+    # Deliver everything that was queued and wait for the App Home republishes
+    worker = outbox.DeliveryWorker(checks.client)
+    start = time.perf_counter()
+    while outbox.pending_count():
+        worker.deliver_due()
+        if outbox.pending_count():
+            time.sleep(0.05)
+    drain_seconds = time.perf_counter() - start
+    jobs.home_jobs.join()
+
+    with open(result_path, "w") as f:
+        json.dump({
+            "import_seconds": import_seconds,
+            "sync_seconds": sync_seconds,
+            "cycle_seconds": cycle_seconds,
+            "drain_seconds": drain_seconds,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "outbox": outbox.stats(),
+            "skipped_sites": metrics.check_cycle_skipped_sites.values.get((), 0),
+            "quota_rejections": sum(metrics.uptimerobot_quota_rejections.values.values()),
+        }, f)
+
+
+def run_size(site_count, args, uptime, slack):
+    uptime.reset()
+    slack.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        result_path = os.path.join(tmp, "result.json")
+        seed_db(db_path, site_count)
+
+        env = dict(os.environ)
+        env.update({
+            "DB_PATH": db_path,
+            "UPTIME_API_URL": f"{uptime.url}/v2/getMonitors",
+            "SLACK_API_URL": f"{slack.url}/api/",
+            "SLACK_BOT_TOKEN": "xoxb-bench",
+            "SLACK_SIGNING_SECRET": "bench-signing-secret",
+            "DEBUG_MODE": "False",
+            "OUTBOX_CHANNEL_INTERVAL": "0",
+            "OUTBOX_MAX_ATTEMPTS": "3",
+            # The fakes have no rate limit, so don't let the request budgets skip accounts (the default
+            # free tier only allows 10 requests a minute per key)
+            "UPTIME_RATE_LIMITS": "free=1000000,pro=1000000",
+        })
+        if args.concurrency:
+            env["CHECK_CONCURRENCY"] = str(args.concurrency)
+
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--cycles", str(args.cycles), "--result", result_path],
+            env=env,
+            cwd=app_dir,
+            check=True,
+            stdout=subprocess.DEVNULL if not args.verbose else None,
+        )
+        with open(result_path) as f:
+            result = json.load(f)
+
+    result["sites"] = site_count
+    result["uptime_requests"] = dict(uptime.counts)
+    result["slack_requests"] = dict(slack.counts)
+    return result
+
+
+def report(results):
+    print(f"{'sites':>7} {'import s':>9} {'sync s':>7} {'cycle min':>10} {'cycle avg':>10} {'cycle max':>10} {'UR reqs':>8} {'UR errs':>8} {'posts':>7} {'drain s':>8} {'homes':>6} {'skipped':>8} {'quota':>6} {'peak MB':>8}")
+    for result in results:
+        cycles = result["cycle_seconds"]
+        uptime_errors = result["uptime_requests"].get("errors", 0) + result["uptime_requests"].get("rate_limited", 0)
+        print(
+            f"{result['sites']:>7} {result['import_seconds']:>9.2f} {max(result['sync_seconds']):>7.3f} {min(cycles):>10.3f} {sum(cycles) / len(cycles):>10.3f} {max(cycles):>10.3f} "
+            f"{result['uptime_requests'].get('requests', 0):>8} {uptime_errors:>8} {result['slack_requests'].get('chat.postMessage', 0):>7} "
+            f"{result['drain_seconds']:>8.2f} {result['slack_requests'].get('views.publish', 0):>6} {result['skipped_sites']:>8} {result['quota_rejections']:>6} {result['peak_rss_mb']:>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scheduled check against local fake UptimeRobot and Slack servers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="numbers of sites to benchmark")
+    parser.add_argument("--cycles", type=int, default=3, help="check cycles to run per size")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds of latency the fakes add to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests the fakes fail with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests the fakes fail with a 429")
+    parser.add_argument("--down-rate", type=float, default=0.01, help="chance a monitor is reported down in any response")
+    parser.add_argument("--concurrency", type=int, help="CHECK_CONCURRENCY for the app")
+    parser.add_argument("--json", action="store_true", help="print the raw results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the app's output")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.cycles, args.result)
+        return
+
+    uptime = FakeUptimeRobot(
+        monitors_per_account=sites_per_account,
+        down_rate=args.down_rate,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    ).start()
+    slack = FakeSlack(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate).start()
+    try:
+        results = [run_size(site_count, args, uptime, slack) for site_count in args.sizes]
+    finally:
+        uptime.stop()
+        slack.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
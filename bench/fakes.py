@@ -0,0 +1,166 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import threading
+import random
+import sys
+import json
+import time
+
+
+# Local stand-ins for the UptimeRobot getMonitors API and the Slack Web API, for benchmarks and load tests.
+# Both can add latency and fail a share of requests with a 500 or a 429 so the bot can be measured
+# against a slow or struggling upstream without touching the real services.
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    # Clients going away, like an app under test being stopped, isn't worth a traceback
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeServer:
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.server = None
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+    # Decide how to answer a request: None to answer normally, otherwise (status, headers, body)
+    def injected_failure(self):
+        if self.latency:
+            time.sleep(self.latency)
+        roll = self.roll()
+        if roll < self.rate_limit_rate:
+            self.count("rate_limited")
+            return 429, {"Retry-After": "1"}, {"ok": False, "stat": "fail", "error": "ratelimited"}
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.count("errors")
+            return 500, {}, {"ok": False, "stat": "fail", "error": "internal_error"}
+        return None
+
+    def handle(self, path, params):
+        raise NotImplementedError
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode() if length else ""
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if self.headers.get("Content-Type", "").startswith("application/json") and body:
+                    params.update(json.loads(body))
+                else:
+                    params.update({key: values[0] for key, values in parse_qs(body).items()})
+                fake.count("requests")
+                status, headers, payload = fake.injected_failure() or fake.handle(url.path, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = QuietHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+# Fake getMonitors. Account "key-<a>" has monitors for "site-<a>-<i>.example.com" for i below
+# monitors_per_account. Each response reports a monitor as down with probability down_rate, so
+# repeated checks produce a steady trickle of status changes.
+class FakeUptimeRobot(FakeServer):
+    def __init__(self, monitors_per_account=100, down_rate=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.monitors_per_account = monitors_per_account
+        self.down_rate = down_rate
+
+    def monitor(self, account, i):
+        website = f"site-{account}-{i}.example.com"
+        return {
+            "id": account * 1000000 + i,
+            "friendly_name": website,
+            "url": f"https://{website}",
+            "type": 1,
+            "status": 9 if self.roll() < self.down_rate else 2,
+        }
+
+    def handle(self, path, params):
+        api_key = params.get("api_key", "")
+        if not api_key.startswith("key-"):
+            return 200, {}, {"stat": "fail", "error": {"type": "invalid_parameter", "parameter_name": "api_key"}}
+        account = int(api_key[4:])
+
+        if params.get("monitors"):
+            self.count("single_lookups")
+            monitors = []
+            for value in params["monitors"].split("-"):
+                if value.isdigit():
+                    i = int(value) - account * 1000000
+                elif value.startswith(f"site-{account}-"):
+                    i = int(value.split("-")[2].split(".")[0])
+                else:
+                    continue
+                if 0 <= i < self.monitors_per_account:
+                    monitors.append(self.monitor(account, i))
+            return 200, {}, {"stat": "ok", "monitors": monitors}
+
+        self.count("page_requests")
+        offset = int(params.get("offset", 0))
+        limit = min(int(params.get("limit", 50)), 50)
+        end = min(offset + limit, self.monitors_per_account)
+        monitors = [self.monitor(account, i) for i in range(offset, end)]
+        return 200, {}, {
+            "stat": "ok",
+            "pagination": {"offset": offset, "limit": limit, "total": self.monitors_per_account},
+            "monitors": monitors,
+        }
+
+
+# Fake Slack Web API that answers ok to everything and counts calls per method
+class FakeSlack(FakeServer):
+    def handle(self, path, params):
+        method = path.rstrip("/").rsplit("/", 1)[-1]
+        self.count(method)
+        if method == "auth.test":
+            return 200, {}, {"ok": True, "user_id": "UBENCH", "team_id": "TBENCH"}
+        if method == "chat.postMessage":
+            return 200, {}, {"ok": True, "channel": params.get("channel"), "ts": f"{time.time():.6f}"}
+        return 200, {}, {"ok": True}
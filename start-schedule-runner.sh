@@ -1,6 +1,4 @@
 #!/bin/bash
-/bin/sleep 5
-
 . "/home/$USER/uptime-robot-bot/venv/bin/activate"
 cd "/home/$USER/uptime-robot-bot/app"
 
@@ -8,4 +6,4 @@ set -a
 source "/home/$USER/uptime-robot-bot/app/.env"
 set +a
 
-python3 scheduler_runner.py
\ No newline at end of file
+exec python3 scheduler_runner.py
\ No newline at end of file
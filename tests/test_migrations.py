@@ -0,0 +1,88 @@
+import sqlite3
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import db
+import migrations
+
+
+# Runs the migrations on an empty db in a temporary directory, with a few sites so the plans are realistic
+@pytest.fixture
+def conn(tmp_path):
+    db.close_connection()
+    db.db_path = str(tmp_path / "test.db")
+    migrations.migrate()
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO monitor_sites (user_id, channel_id, website, api_key, last_status, monitor_id) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"U{i % 10}", f"C{i % 5}", f"site-{i}.example.com", f"key-{i % 3}", "2", i) for i in range(100)]
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    yield conn
+    db.close_connection()
+
+
+# Whether the query looks up monitor_sites with the index rather than scanning the table
+def searches_index(conn, query, params, index):
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+    return any(step.startswith("SEARCH monitor_sites USING") and f"INDEX {index} " in step for step in plan)
+
+
+def test_home_uses_user_channel_website_index(conn):
+    query = "SELECT user_id, channel_id, website, last_status FROM monitor_sites WHERE user_id = ?"
+    assert searches_index(conn, query, ("U1",), "monitor_sites_user_channel_website")
+
+    query = "SELECT user_id, channel_id, website, last_status FROM monitor_sites WHERE user_id IN (?, ?)"
+    assert searches_index(conn, query, ("U1", "U2"), "monitor_sites_user_channel_website")
+
+
+def test_remove_uses_user_channel_website_index(conn):
+    query = "DELETE FROM monitor_sites WHERE user_id=? AND channel_id=? AND website=?"
+    assert searches_index(conn, query, ("U1", "C1", "site-1.example.com"), "monitor_sites_user_channel_website")
+
+
+def test_check_sites_in_db_channel_filter_uses_channel_index(conn):
+    query = "SELECT user_id, channel_id, website, api_key, monitor_id, last_status, monitor_url, last_checked_at FROM monitor_sites WHERE channel_id = ? ORDER BY +api_key"
+    assert searches_index(conn, query, ("C1",), "monitor_sites_channel")
+
+
+def test_webhook_lookup_uses_api_key_website_index(conn):
+    query = "SELECT user_id, channel_id, website, last_status FROM monitor_sites WHERE api_key = ? AND (monitor_id = ? OR (monitor_id IS NULL AND website IN (?)))"
+    assert searches_index(conn, query, ("key-1", 1, "site-1.example.com"), "monitor_sites_api_key_website")
+
+
+def test_stored_monitor_id_lookup_uses_api_key_website_index(conn):
+    query = "SELECT monitor_id FROM monitor_sites WHERE website = ? AND api_key = ? AND monitor_id IS NOT NULL LIMIT 1"
+    assert searches_index(conn, query, ("site-1.example.com", "key-1"), "monitor_sites_api_key_website")
+
+
+def test_adding_a_site_twice_does_nothing(conn):
+    query = "INSERT INTO monitor_sites (user_id, channel_id, website, api_key, last_status) VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id, channel_id, website) DO NOTHING"
+    site = ("U1", "C1", "new.example.com", "key-1", "2")
+    assert conn.execute(query, site).rowcount == 1
+    assert conn.execute(query, site).rowcount == 0
+    count = conn.execute("SELECT COUNT(*) FROM monitor_sites WHERE user_id = ? AND channel_id = ? AND website = ?", site[:3]).fetchone()[0]
+    assert count == 1
+
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO monitor_sites (user_id, channel_id, website, api_key, last_status) VALUES (?, ?, ?, ?, ?)", site)
+
+
+def test_migrate_twice_is_a_no_op(conn):
+    def schema():
+        return conn.execute("SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY type, name").fetchall()
+
+    before = schema()
+    applied = conn.execute("SELECT version, applied_at FROM schema_migrations ORDER BY version").fetchall()
+    sites = conn.execute("SELECT COUNT(*) FROM monitor_sites").fetchone()[0]
+
+    migrations.migrate()
+
+    assert schema() == before
+    assert conn.execute("SELECT version, applied_at FROM schema_migrations ORDER BY version").fetchall() == applied
+    assert [version for version, _ in applied] == [version for version, _, _ in migrations.migrations]
+    assert conn.execute("SELECT COUNT(*) FROM monitor_sites").fetchone()[0] == sites